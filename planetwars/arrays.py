@@ -0,0 +1,219 @@
+"""Struct-of-arrays universe backend.
+
+All planet and fleet data lives in contiguous typed columns (numpy arrays if numpy is installed,
+array.array otherwise). ArrayPlanet and ArrayFleet are lightweight __slots__ views onto one row of
+those columns and can be used exactly like the default Planet and Fleet objects (except that you
+can't set arbitrary attributes on them).
+
+Usage:
+>>> from planetwars.arrays import ArrayUniverse
+>>> Game(MyBot, universe_class=ArrayUniverse)
+
+Inside the bot the whole map can then be processed at once, e.g. (with numpy):
+>>> owners = self.universe.planet_array("owner")
+>>> ships = self.universe.planet_array("ship_count")
+>>> my_ships = ships[owners == ME.id].sum()
+"""
+from array import array
+from planetwars.planet import BasePlanet
+from planetwars.fleet import BaseFleet
+from planetwars.player import PLAYER_MAP
+from planetwars.universe import Universe
+from planetwars.util import Point, deep_sizeof
+
+try:
+    #noinspection PyUnresolvedReferences
+    import numpy
+except ImportError:
+    numpy = None
+
+_NUMPY_TYPES = {
+    "b": "int8",
+    "i": "int32",
+    "d": "float64",
+}
+
+class Columns(object):
+    """A table of equally sized typed columns. Each column is available as an attribute.
+    The columns are over-allocated; only the first <size> rows are in use.
+    Rows that have been freed are reused by later calls to add().
+    """
+    def __init__(self, columns, capacity=16, use_numpy=True):
+        self.names = [name for name, typecode in columns]
+        self.typecodes = dict(columns)
+        self.use_numpy = use_numpy and numpy is not None
+        self.size = 0
+        self.capacity = 0
+        self._free = []
+        for name in self.names:
+            setattr(self, name, self._allocate(name, 0))
+        self._grow(capacity)
+
+    def _allocate(self, name, count):
+        if self.use_numpy:
+            return numpy.zeros(count, dtype=_NUMPY_TYPES[self.typecodes[name]])
+        return array(self.typecodes[name], [0]) * count
+
+    def _grow(self, capacity):
+        for name in self.names:
+            column = getattr(self, name)
+            if self.use_numpy:
+                column = numpy.concatenate((column, self._allocate(name, capacity - self.capacity)))
+            else:
+                column.extend(self._allocate(name, capacity - self.capacity))
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def add(self, *values):
+        """Store a new row (values in column order). Returns the row index."""
+        if self._free:
+            index = self._free.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow(self.capacity * 2)
+            index = self.size
+            self.size += 1
+        for name, value in zip(self.names, values):
+            getattr(self, name)[index] = value
+        return index
+
+    def free(self, index):
+        """Mark a row as unused. It will be reused by the next call to add()."""
+        self._free.append(index)
+
+    def row(self, index):
+        """Returns a copy of the row <index> as a _Row object."""
+        return _Row(self.names, [getattr(self, name)[index] for name in self.names])
+
+
+class _Row(object):
+    """A single detached row that can stand in for a Columns object (at index 0)."""
+    def __init__(self, names, values):
+        for name, value in zip(names, values):
+            setattr(self, name, [value])
+
+
+PLANET_COLUMNS = (
+    ("owner", "b"),
+    ("ship_count", "i"),
+    ("growth_rate", "i"),
+    ("x", "d"),
+    ("y", "d"),
+)
+
+FLEET_COLUMNS = (
+    ("alive", "b"),
+    ("owner", "b"),
+    ("ship_count", "i"),
+    ("source", "i"),
+    ("destination", "i"),
+    ("trip_length", "i"),
+    ("turns_remaining", "i"),
+)
+
+def _column_property(name, doc, to_python=int, from_python=int):
+    def getter(self):
+        return to_python(getattr(self._columns, name)[self._index])
+    def setter(self, value):
+        getattr(self._columns, name)[self._index] = from_python(value)
+    return property(getter, setter, doc=doc)
+
+def _owner_property():
+    return _column_property("owner", "The Player owning this object.",
+                            to_python=lambda id: PLAYER_MAP[int(id)], from_python=lambda player: player.id)
+
+
+class ArrayPlanet(BasePlanet):
+    """A view onto one row of the universe's planet columns."""
+    __slots__ = ("universe", "id", "_columns", "_index", "_distances", "_neighbors")
+
+    def __init__(self, universe, id, x, y, owner, ship_count, growth_rate):
+        self.universe = universe
+        self.id = int(id)
+        self._columns = universe.planet_columns
+        self._index = self._columns.add(int(owner), int(ship_count), int(growth_rate), float(x), float(y))
+
+    owner = _owner_property()
+    ship_count = _column_property("ship_count", "The number of ships on this planet.")
+    growth_rate = _column_property("growth_rate", "The growth rate of this planet.")
+
+    @property
+    def position(self):
+        columns = self._columns
+        return Point(float(columns.x[self._index]), float(columns.y[self._index]))
+
+
+class ArrayFleet(BaseFleet):
+    """A view onto one row of the universe's fleet columns.
+    Once the fleet has arrived the view is detached from the universe (and keeps its last values)."""
+    __slots__ = ("universe", "id", "_columns", "_index")
+
+    def __init__(self, universe, id, owner, ship_count, source, destination, trip_length, turns_remaining):
+        self.universe = universe
+        self.id = int(id)
+        self._columns = universe.fleet_columns
+        self._index = self._columns.add(1, int(owner), int(ship_count), int(source), int(destination),
+                                        int(trip_length), int(turns_remaining))
+
+    owner = _owner_property()
+    ship_count = _column_property("ship_count", "The number of ships in this fleet.")
+    trip_length = _column_property("trip_length", "The total number of turns this fleet travels.")
+    turns_remaining = _column_property("turns_remaining", "The number of turns until this fleet arrives.")
+
+    @property
+    def source(self):
+        return self.universe._planets.get(int(self._columns.source[self._index]))
+
+    @property
+    def destination(self):
+        return self.universe._planets.get(int(self._columns.destination[self._index]))
+
+    def _detach(self):
+        columns, index = self._columns, self._index
+        self._columns = columns.row(index)
+        self._index = 0
+        columns.alive[index] = 0
+        columns.free(index)
+
+
+class ArrayUniverse(Universe):
+    """Universe that keeps all planet and fleet data in typed columns (@see Columns).
+
+    planet_array() and fleet_array() return whole columns for vectorized processing.
+    """
+    def __init__(self, game, planet_class=ArrayPlanet, fleet_class=ArrayFleet, use_numpy=True):
+        self.planet_columns = Columns(PLANET_COLUMNS, use_numpy=use_numpy)
+        self.fleet_columns = Columns(FLEET_COLUMNS, capacity=64, use_numpy=use_numpy)
+        super(ArrayUniverse, self).__init__(game, planet_class=planet_class, fleet_class=fleet_class)
+
+    def planet_array(self, name):
+        """Returns the column <name> (one of owner, ship_count, growth_rate, x, y) for all planets
+        indexed by planet id. With numpy this is a view onto the live data."""
+        return getattr(self.planet_columns, name)[:self.planet_columns.size]
+
+    def fleet_array(self, name):
+        """Returns the column <name> (one of owner, ship_count, source, destination, trip_length,
+        turns_remaining) for all fleets in flight (in no particular order)."""
+        columns = self.fleet_columns
+        column = getattr(columns, name)[:columns.size]
+        alive = columns.alive[:columns.size]
+        if columns.use_numpy:
+            return column[alive == 1]
+        return array(columns.typecodes[name], [value for value, is_alive in zip(column, alive) if is_alive])
+
+    def _remove_fleet(self, fleet):
+        super(ArrayUniverse, self)._remove_fleet(fleet)
+        fleet._detach()
+
+    def teardown(self):
+        use_numpy = self.planet_columns.use_numpy
+        super(ArrayUniverse, self).teardown()
+        self.planet_columns = Columns(PLANET_COLUMNS, use_numpy=use_numpy)
+        self.fleet_columns = Columns(FLEET_COLUMNS, use_numpy=use_numpy)
+
+    def memory_usage(self):
+        usage = super(ArrayUniverse, self).memory_usage()
+        usage["planets"] += deep_sizeof(vars(self.planet_columns))
+        usage["fleets"] += deep_sizeof(vars(self.fleet_columns))
+        usage["total"] = usage["planets"] + usage["fleets"] + usage["caches"] + usage["indexes"]
+        return usage
@@ -1,4 +1,10 @@
 class BaseBot(object):
+    # TimeBudget for the current turn (@see budget.py). Set before do_turn() is called.
+    budget = None
+    # Return value of ponder() from the previous turn (@see ponder.py). Bots may define
+    # ponder(self, stopped) to use the time between turns.
+    ponder_result = None
+
     def __init__(self, universe):
         self.universe = universe
 
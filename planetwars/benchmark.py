@@ -0,0 +1,206 @@
+"""Replay driven performance regression benchmark.
+
+Streams the states of recorded games (@see replay.py) through a bot without the engine and without
+stdin / stdout and measures every turn phase (@see stats.PHASES):
+  parse:               Universe.update_state
+  do_turn:             the bot's do_turn()
+  flush:               formatting the orders (like Game.turn_done, but into a memory buffer)
+  universe_turn_done:  Universe.turn_done
+
+For every phase it reports the latency distribution and the net number of objects allocated (container
+objects tracked by the garbage collector, allocations minus deallocations). The garbage collector is disabled
+while a phase runs so its generation 0 count is exact; the collections happen between the phases instead.
+It also reports the peak memory of the process.
+
+The report can be saved as a baseline and later runs compared against it. A phase regresses if its
+latency (by default the 95th percentile) grew by more than <threshold> (relative) compared to the baseline.
+
+Command line:
+python -m planetwars.benchmark mybot:MyBot game1.pwr game2.pwr --save-baseline baseline.json
+python -m planetwars.benchmark mybot:MyBot game1.pwr game2.pwr --baseline baseline.json --threshold 0.2
+(exits with status 1 if a phase regressed)
+"""
+import gc
+import os
+import sys
+from cStringIO import StringIO
+from optparse import OptionParser
+from time import time
+from planetwars.budget import TimeBudget
+from planetwars.compat import json
+from planetwars.orders import OrderBuffer
+from planetwars.replay import Replay
+from planetwars.stats import PHASES, Histogram, TurnStats
+from planetwars.universe import Universe
+from planetwars.util import TimeIsUp
+
+try:
+    import resource
+except ImportError:
+    # Not available on windows
+    resource = None
+
+def peak_memory():
+    """Returns the peak resident memory of this process in KiB (None if it can't be determined)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes instead of KiB
+        peak //= 1024
+    return peak
+
+
+class BenchmarkGame(OrderBuffer):
+    """Stands in for Game: collects the orders and 'sends' them into a memory buffer."""
+    def __init__(self):
+        super(BenchmarkGame, self).__init__()
+        self.output = StringIO()
+
+    def flush(self):
+        self.write(self.output)
+        self.clear()
+        self.output.seek(0)
+        self.output.truncate()
+
+
+class BenchmarkStats(TurnStats):
+    """TurnStats that also record allocation counts per phase and the peak memory."""
+    def __init__(self, timeout=None):
+        super(BenchmarkStats, self).__init__(timeout)
+        self.allocations = dict((phase, Histogram()) for phase in PHASES)
+        self.peak_memory = None
+
+    def report(self):
+        report = super(BenchmarkStats, self).report()
+        report["allocations"] = dict((phase, histogram.summary()) for phase, histogram in self.allocations.iteritems())
+        report["peak_memory_kb"] = self.peak_memory
+        return report
+
+
+def _measure(stats, phase, function, *args):
+    enabled = gc.isenabled()
+    gc.disable()
+    count = gc.get_count()[0]
+    start = time()
+    try:
+        return function(*args)
+    finally:
+        stats.add(phase, time() - start)
+        stats.allocations[phase].add(max(gc.get_count()[0] - count, 0))
+        if enabled:
+            gc.enable()
+
+def benchmark_replay(replay, bot_class, stats, universe_class=Universe, timeout=1.0):
+    """Play the recorded states of <replay> (a Replay or a file name) through a new <bot_class> instance
+    and record the measurements in <stats>."""
+    if isinstance(replay, basestring):
+        replay = Replay(replay)
+        try:
+            return benchmark_replay(replay, bot_class, stats, universe_class, timeout)
+        finally:
+            replay.close()
+    game = BenchmarkGame()
+    universe = universe_class(game)
+    bot = bot_class(universe)
+    for state_lines, _ in replay.turns():
+        _measure(stats, "parse", universe.update_state, state_lines)
+        budget = bot.budget = TimeBudget(timeout, universe=universe)
+        aborted = False
+        try:
+            _measure(stats, "do_turn", bot.do_turn)
+        except TimeIsUp:
+            aborted = True
+        budget.send_best_orders(aborted)
+        _measure(stats, "flush", game.flush)
+        _measure(stats, "universe_turn_done", universe.turn_done)
+        stats.turn_done()
+    universe.teardown()
+    stats.peak_memory = peak_memory()
+    return stats
+
+def run_benchmark(bot_class, replays, universe_class=Universe, timeout=1.0, repeat=1):
+    """Benchmark <bot_class> on all <replays> (Replay objects or file names) <repeat> times.
+    Returns the BenchmarkStats."""
+    stats = BenchmarkStats(timeout)
+    for _ in xrange(repeat):
+        for replay in replays:
+            benchmark_replay(replay, bot_class, stats, universe_class, timeout)
+    return stats
+
+def compare(report, baseline, threshold=0.2, metric="p95", min_delta=0.0005):
+    """Compare the phase latencies of <report> with <baseline> (both as returned by BenchmarkStats.report()).
+    Returns a list of (name, baseline_value, value) tuples of all phases (and the whole turn time) whose
+    <metric> got slower by more than <threshold> (relative) and at least <min_delta> seconds."""
+    regressions = []
+    timings = [(phase, report["phases"].get(phase, {}), baseline["phases"].get(phase, {})) for phase in PHASES]
+    timings.append(("turn_time", report["turn_time"], baseline["turn_time"]))
+    for name, current, base in timings:
+        if metric not in current or metric not in base:
+            continue
+        if current[metric] > base[metric] * (1 + threshold) and current[metric] - base[metric] >= min_delta:
+            regressions.append((name, base[metric], current[metric]))
+    return regressions
+
+def format_report(report):
+    """Returns a human readable table of a report."""
+    lines = ["%-20s %8s %10s %10s %10s %10s %12s" % ("Phase", "Turns", "p50 ms", "p95 ms", "p99 ms", "max ms", "allocs p95")]
+    for name in PHASES + ("turn_time", ):
+        if name == "turn_time":
+            timing, allocations = report["turn_time"], {}
+        else:
+            timing, allocations = report["phases"][name], report["allocations"][name]
+        if not timing["count"]:
+            continue
+        lines.append("%-20s %8d %10.3f %10.3f %10.3f %10.3f %12s" % (
+            name, timing["count"], timing["p50"] * 1000, timing["p95"] * 1000, timing["p99"] * 1000,
+            timing["max"] * 1000, allocations.get("p95", "")))
+    lines.append("")
+    lines.append("Turns over the timeout: %d, peak memory: %s KiB" % (report["timeouts"], report["peak_memory_kb"]))
+    return "\n".join(lines)
+
+def main(args=None):
+    from planetwars.tournament import load_bot_class
+    parser = OptionParser(usage="%prog [options] module:BotClass RECORDING [...]")
+    parser.add_option("-u", "--universe", dest="universe", default=None,
+                      help="Universe class to use (module:Class).", metavar="CLASS")
+    parser.add_option("-t", "--timeout", dest="timeout", type="float", default=1.0,
+                      help="Turn timeout in seconds (for the bots TimeBudget). Defaults to 1.0.")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=1,
+                      help="Play every recording REPEAT times.")
+    parser.add_option("--baseline", dest="baseline", default=None,
+                      help="Compare against the baseline in FILE. Exit with status 1 on regressions.", metavar="FILE")
+    parser.add_option("--save-baseline", dest="save_baseline", default=None,
+                      help="Save the report as baseline to FILE.", metavar="FILE")
+    parser.add_option("--threshold", dest="threshold", type="float", default=0.2,
+                      help="Allowed relative slowdown per phase. Defaults to 0.2 (20%).")
+    parser.add_option("--metric", dest="metric", default="p95", type="choice",
+                      choices=["p50", "p95", "p99", "max", "mean"],
+                      help="Latency metric to compare. Defaults to p95.")
+    options, args = parser.parse_args(args)
+    if len(args) < 2:
+        parser.error("Need a bot class and at least one recording.")
+    sys.path.insert(0, os.getcwd())
+    universe_class = Universe
+    if options.universe:
+        universe_class = load_bot_class(options.universe)
+    stats = run_benchmark(load_bot_class(args[0]), args[1:], universe_class, options.timeout, options.repeat)
+    report = stats.report()
+    print format_report(report)
+    if options.save_baseline:
+        stats.write_report(options.save_baseline)
+    if options.baseline:
+        baseline_file = open(options.baseline)
+        try:
+            baseline = json.load(baseline_file)
+        finally:
+            baseline_file.close()
+        regressions = compare(report, baseline, options.threshold, options.metric)
+        for name, base, current in regressions:
+            print "REGRESSION %s: %s %0.3f ms -> %0.3f ms" % (name, options.metric, base * 1000, current * 1000)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
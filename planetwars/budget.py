@@ -0,0 +1,82 @@
+from time import time
+from planetwars.util import TimeIsUp
+
+class TimeBudget(object):
+    """Cooperative time budget for one turn. Game hands a fresh one to the bot (as bot.budget) every turn.
+
+    Instead of relying on the TimeIsUp exception (which throws away everything the bot was doing)
+    long running searches can ask the budget how much time is left and stop on their own:
+
+    >>> while self.budget.checkpoint():
+    ...     orders = self.search(depth)
+    ...     self.budget.set_best_orders(orders)
+    ...     depth += 1
+
+    The best orders registered with set_best_orders() are sent when the turn ends - even if the turn
+    is aborted by TimeIsUp. They are sent in addition to any orders the bot sent itself, unless the turn
+    was aborted: then the orders the bot sent during the turn (a half finished plan) are discarded first.
+
+    The budget expires <margin> seconds before <timeout> (measured from <start>) to leave time for
+    sending the orders. A timeout of None never expires. <universe> is the universe the orders of the turn
+    are sent to (needed to discard them after an aborted turn).
+    """
+    def __init__(self, timeout, margin=0.05, start=None, universe=None):
+        if start is None:
+            start = time()
+        self.start = start
+        self.universe = universe
+        self.timeout = timeout
+        if timeout is None:
+            self.deadline = None
+        else:
+            self.deadline = start + timeout - margin
+        self.best_orders = None
+        self.longest_step = 0.0
+        self._last_checkpoint = start
+
+    def elapsed(self):
+        """Seconds since the turn started."""
+        return time() - self.start
+
+    def remaining(self):
+        """Seconds left until the budget expires (may be negative)."""
+        if self.deadline is None:
+            return float("inf")
+        return self.deadline - time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def has_time(self, seconds):
+        """Returns True if there are at least <seconds> seconds left."""
+        return self.remaining() > seconds
+
+    def checkpoint(self):
+        """Call this once per iteration of a search loop.
+        Returns True if there is enough time left for another iteration that takes as long as the
+        longest one so far.
+        """
+        now = time()
+        self.longest_step = max(self.longest_step, now - self._last_checkpoint)
+        self._last_checkpoint = now
+        return self.has_time(self.longest_step)
+
+    def check(self):
+        """Raises TimeIsUp if the budget has expired. Useful to bail out of deep recursions."""
+        if self.expired():
+            raise TimeIsUp()
+
+    def set_best_orders(self, orders):
+        """Register the best orders found so far as a list of (source, destination, ship_count) tuples
+        (source and destination are Planet objects). Replaces previously registered orders."""
+        self.best_orders = list(orders)
+
+    def send_best_orders(self, aborted=False):
+        """Send the registered orders (orders the source planet doesn't have enough ships for are skipped).
+        If the turn was <aborted> by TimeIsUp and there are registered orders, the orders sent during the turn
+        are discarded first (@see Universe.discard_orders). Gets called from Game at the end of the turn."""
+        orders, self.best_orders = self.best_orders, None
+        if orders and aborted and self.universe is not None:
+            self.universe.discard_orders()
+        for source, destination, ship_count in orders or ():
+            source.send_fleet(destination, ship_count)
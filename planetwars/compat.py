@@ -113,3 +113,12 @@ except ImportError:
             pass
 
         return result
+
+try:
+    import json
+except ImportError:
+    try:
+        #noinspection PyUnresolvedReferences
+        import simplejson as json
+    except ImportError:
+        json = None
@@ -0,0 +1,242 @@
+"""In-process match engine.
+
+Plays bots against each other inside one Python process - no tournament engine, no pipes.
+Every bot gets its own Universe that sees the game from its point of view (i.e. the bot is always
+player.ME) exactly like it would when talking to the real engine.
+
+Example:
+>>> from planetwars.engine import play_match
+>>> result = play_match("maps/map7.txt", [MyBot, StupidBot])
+>>> result.winner
+1
+"""
+import signal
+from time import time
+from logging import getLogger
+from planetwars.compat import namedtuple
+from planetwars.orders import OrderBuffer
+from planetwars.planet import point_distance
+from planetwars.player import NOBODY
+from planetwars.simulation import resolve_battle
+from planetwars.universe import Universe
+from planetwars.util import ParsingException, TimeIsUp, timeout_handler
+from planetwars.budget import TimeBudget
+
+log = getLogger(__name__)
+
+class MatchResult(namedtuple("MatchResult", "winner turns ship_counts dropped")):
+    """Outcome of a match.
+    winner: the player id (1 based seat number) of the winner or 0 for a draw.
+    turns: number of turns played.
+    ship_counts: list of the ship counts (planets + fleets) of every player at the end (index 0 is player 1).
+    dropped: list of the player ids that were dropped because of invalid orders, exceptions or timeouts.
+    """
+
+def parse_map(lines):
+    """Parse a map in the standard format ("P x y owner ship_count growth_rate" lines).
+    Returns a list of (x, y, owner, ship_count, growth_rate) tuples (x and y are kept as strings)."""
+    planets = []
+    for line in lines:
+        tokens = line.split("#")[0].split()
+        if not tokens:
+            continue
+        if tokens[0] != "P" or len(tokens) != 6:
+            raise ParsingException("Invalid format in map: '%s'" % (line,))
+        planets.append((tokens[1], tokens[2], int(tokens[3]), int(tokens[4]), int(tokens[5])))
+    return planets
+
+def load_map(filename):
+    """Load a map file. @see parse_map"""
+    map_file = open(filename)
+    try:
+        return parse_map(map_file)
+    finally:
+        map_file.close()
+
+
+class Seat(OrderBuffer):
+    """One player in a match. Acts as the 'game' of the players universe (collecting its orders)."""
+    def __init__(self, match, player_id, bot_class, universe_class):
+        super(Seat, self).__init__()
+        self.match = match
+        self.player_id = player_id
+        self.timeout = match.timeout
+        self.universe = universe_class(self)
+        self.bot = bot_class(self.universe)
+        self.dropped = False
+
+    def pov(self, owner):
+        """Translate an owner id into this players point of view (in which it is always player 1)."""
+        if owner == self.player_id:
+            return 1
+        if owner == 1:
+            return self.player_id
+        return owner
+
+
+class Match(object):
+    """A single game between two or more bots (bot classes, the first one is player 1 etc.)
+    on a map (@see load_map).
+
+    Rules are those of the contest: orders that name a planet the player doesn't own, more ships than
+    available or invalid planets get the player dropped, as do exceptions raised by the bot and turns
+    that take longer than <timeout> seconds (None disables the timeout). Like Game, a turn that overruns is
+    interrupted with TimeIsUp (via SIGALRM) when the match runs in the main thread on a platform that has
+    signal.setitimer; elsewhere the timeout is only checked after the turn.
+    The game ends when at most one player is left or after <max_turns> turns. The player with the most
+    ships wins then.
+    """
+    def __init__(self, map_planets, bot_classes, max_turns=200, timeout=1.0, universe_class=Universe):
+        self.max_turns = max_turns
+        self.timeout = timeout
+        self.has_alarm = hasattr(signal, "SIGALRM") and hasattr(signal, "setitimer")
+        self.turn = 0
+        self.positions = [(float(x), float(y)) for x, y, _, _, _ in map_planets]
+        self._coordinates = [(x, y) for x, y, _, _, _ in map_planets]
+        self.owners = [owner for _, _, owner, _, _ in map_planets]
+        self.ship_counts = [ship_count for _, _, _, ship_count, _ in map_planets]
+        self.growth_rates = [growth_rate for _, _, _, _, growth_rate in map_planets]
+        # [owner, ship_count, source, destination, trip_length, turns_remaining]
+        self.fleets = []
+        self.distances = [[point_distance(a, b) for b in self.positions] for a in self.positions]
+        self.seats = [Seat(self, index + 1, bot_class, universe_class)
+                      for index, bot_class in enumerate(bot_classes)]
+
+    def play(self):
+        """Play the match until it's over. Returns a MatchResult.
+        The universes of all players are torn down (@see Universe.teardown) afterwards."""
+        while self.winner() is None:
+            self.play_turn()
+        result = MatchResult(self.winner(), self.turn, [self.ship_count(seat.player_id) for seat in self.seats],
+                             [seat.player_id for seat in self.seats if seat.dropped])
+        for seat in self.seats:
+            seat.universe.teardown()
+        return result
+
+    def play_turn(self):
+        """Let every bot take its turn and advance the game by one turn."""
+        self.turn += 1
+        orders = []
+        for seat in self.seats:
+            if seat.dropped:
+                continue
+            self._send_state(seat)
+            turn_start = time()
+            budget = seat.bot.budget = TimeBudget(self.timeout, start=turn_start, universe=seat.universe)
+            aborted = False
+            try:
+                alarm = self._arm_alarm()
+                try:
+                    seat.bot.do_turn()
+                finally:
+                    if alarm:
+                        self._disarm_alarm()
+            except TimeIsUp:
+                aborted = True
+                log.warning("Player %d failed to catch TimeIsUp exception!" % seat.player_id)
+            except Exception:
+                log.error("Exception in bot.do_turn() of player %d" % seat.player_id, exc_info=True)
+                self.drop(seat)
+                continue
+            budget.send_best_orders(aborted)
+            if self.timeout is not None and time() - turn_start > self.timeout:
+                log.warning("Player %d timed out" % seat.player_id)
+                self.drop(seat)
+                continue
+            orders.append((seat, seat.orders()))
+            seat.clear()
+            seat.universe.turn_done()
+        for seat, seat_orders in orders:
+            self.issue_orders(seat, seat_orders)
+        self.advance()
+
+    def _arm_alarm(self):
+        """Make SIGALRM raise TimeIsUp once the turn has taken <timeout> seconds. Returns False if the alarm
+        can't be used (no timeout, no setitimer or not running in the main thread)."""
+        if self.timeout is None or not self.has_alarm:
+            return False
+        try:
+            self._previous_handler = signal.signal(signal.SIGALRM, timeout_handler)
+        except ValueError:
+            # Not in the main thread
+            return False
+        signal.setitimer(signal.ITIMER_REAL, self.timeout)
+        return True
+
+    def _disarm_alarm(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        # None: the previous handler wasn't installed from Python
+        signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+
+    def issue_orders(self, seat, orders):
+        """Validate and execute the (player relative) orders of <seat>."""
+        for source, destination, ship_count in orders:
+            if not (0 <= source < len(self.owners) and 0 <= destination < len(self.owners)) or \
+                    self.owners[source] != seat.player_id or \
+                    not 0 <= ship_count <= self.ship_counts[source]:
+                log.warning("Player %d issued invalid order: %d %d %d" % (seat.player_id, source, destination, ship_count))
+                self.drop(seat)
+                return
+            self.ship_counts[source] -= ship_count
+            trip_length = self.distances[source][destination]
+            self.fleets.append([seat.player_id, ship_count, source, destination, trip_length, trip_length])
+
+    def advance(self):
+        """Advance the game by one turn: growth, fleet movement and battles."""
+        for planet_id, owner in enumerate(self.owners):
+            if owner != NOBODY.id:
+                self.ship_counts[planet_id] += self.growth_rates[planet_id]
+        arrivals = {}
+        in_flight = []
+        for fleet in self.fleets:
+            fleet[5] -= 1
+            if fleet[5] > 0:
+                in_flight.append(fleet)
+            else:
+                forces = arrivals.setdefault(fleet[3], {})
+                forces[fleet[0]] = forces.get(fleet[0], 0) + fleet[1]
+        self.fleets = in_flight
+        for planet_id, forces in arrivals.iteritems():
+            self.owners[planet_id], self.ship_counts[planet_id] = resolve_battle(
+                self.owners[planet_id], self.ship_counts[planet_id], forces)
+
+    def drop(self, seat):
+        """Drop a player from the game. Their planets become neutral and their fleets are destroyed."""
+        seat.dropped = True
+        seat.clear()
+        self.owners = [owner != seat.player_id and owner or NOBODY.id for owner in self.owners]
+        self.fleets = [fleet for fleet in self.fleets if fleet[0] != seat.player_id]
+
+    def ship_count(self, player_id):
+        """Returns the number of ships (on planets and in fleets) of player <player_id>."""
+        return sum([ship_count for owner, ship_count in zip(self.owners, self.ship_counts) if owner == player_id]) + \
+               sum([fleet[1] for fleet in self.fleets if fleet[0] == player_id])
+
+    def winner(self):
+        """Returns the winners player id, 0 for a draw or None if the game isn't over yet."""
+        remaining = set(self.owners) | set([fleet[0] for fleet in self.fleets])
+        remaining.discard(NOBODY.id)
+        if not remaining:
+            return 0
+        if len(remaining) == 1:
+            return remaining.pop()
+        if self.turn >= self.max_turns:
+            ship_counts = sorted([(self.ship_count(player_id), player_id) for player_id in remaining], reverse=True)
+            if ship_counts[0][0] == ship_counts[1][0]:
+                return 0
+            return ship_counts[0][1]
+        return None
+
+    def _send_state(self, seat):
+        pov = seat.pov
+        planets = [(x, y, pov(owner), ship_count, growth_rate) for (x, y), owner, ship_count, growth_rate
+                   in zip(self._coordinates, self.owners, self.ship_counts, self.growth_rates)]
+        fleets = [(pov(owner), ship_count, source, destination, trip_length, turns_remaining)
+                  for owner, ship_count, source, destination, trip_length, turns_remaining in self.fleets]
+        seat.universe.set_state(planets, fleets)
+
+
+def play_match(map_file, bot_classes, **kwargs):
+    """Play one match between <bot_classes> on the map in <map_file>. Keyword arguments are passed on to Match.
+    Returns a MatchResult."""
+    return Match(load_map(map_file), bot_classes, **kwargs).play()
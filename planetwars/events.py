@@ -0,0 +1,37 @@
+"""Change events emitted by the Universe.
+
+Bots that keep derived state (threat maps, frontier sets, ...) can update it incrementally instead of
+recomputing it every turn:
+
+>>> def on_change(event):
+...     if isinstance(event, PlanetCaptured):
+...         frontier.update(event.planet)
+>>> universe.subscribe(on_change)
+
+Alternatively set universe.record_changes = True and read universe.changes: the events since the start of the
+last Universe.turn_done() (i.e. the fleets that arrived, followed by the changes of the current turn's state
+and the fleets sent or discarded during the turn).
+
+Events are emitted once the change that caused them is complete (a whole state update, Universe.turn_done or
+a sent fleet, Universe.discard_orders), so callbacks can query the universe.
+"""
+from planetwars.compat import namedtuple
+
+class PlanetCaptured(namedtuple("PlanetCaptured", "planet old_owner new_owner")):
+    """<planet> changed its owner (Player objects)."""
+
+class ShipDelta(namedtuple("ShipDelta", "planet old_ship_count new_ship_count")):
+    """The ship count of <planet> changed (by growth, battles or fleets sent from it)."""
+    @property
+    def delta(self):
+        return self.new_ship_count - self.old_ship_count
+
+class FleetLaunched(namedtuple("FleetLaunched", "fleet ship_count")):
+    """A new fleet appeared or <ship_count> ships were added to a fleet we sent earlier in the same turn."""
+
+class FleetArrived(namedtuple("FleetArrived", "fleet")):
+    """<fleet> reached its destination (emitted from Universe.turn_done, after the fleet has been removed)."""
+
+class FleetDiscarded(namedtuple("FleetDiscarded", "fleet")):
+    """<fleet> (sent during the current turn) was taken back by Universe.discard_orders (emitted after the
+    fleet has been removed and its ships returned to the source)."""
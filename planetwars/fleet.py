@@ -1,10 +1,18 @@
 from planetwars.player import PLAYER_MAP, NOBODY
-from planetwars.util import TypedSetBase
+from planetwars.util import TypedSetBase, _read_only_class
 from operator import attrgetter
 from itertools import groupby
 from collections import defaultdict
 
-class Fleet(object):
+class BaseFleet(object):
+    """Behaviour shared by all fleet implementations. Subclasses provide the universe, id, owner, ship_count,
+    source, destination, trip_length and turns_remaining attributes (@see Fleet and arrays.ArrayFleet)."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<F(%d) #%d %s -> %s ETA %d>" % (self.id, self.ship_count, self.source, self.destination, self.turns_remaining)
+
+class Fleet(BaseFleet):
     def __init__(self, universe, id, owner, ship_count, source, destination, trip_length, turns_remaining):
         self.universe = universe
         self.id = int(id)
@@ -15,15 +23,12 @@ class Fleet(object):
         self.trip_length = int(trip_length)
         self.turns_remaining = int(turns_remaining)
 
-    def __repr__(self):
-        return "<F(%d) #%d %s -> %s ETA %d>" % (self.id, self.ship_count, self.source, self.destination, self.turns_remaining)
-
 class Fleets(TypedSetBase):
     """Represents a set of Fleet objects.
     All normal set methods are available. Additionaly you can | (or) Fleet objects directly into it.
     Some other convenience methods are available (see below).
     """
-    accepts = (Fleet, )
+    accepts = (BaseFleet, )
 
     @property
     def ship_count(self):
@@ -34,6 +39,7 @@ class Fleets(TypedSetBase):
         """Returns an iterator that yields tuples of (turns_remaining, Fleets)
         for all Subfleets that arrive in this many turns in ascending order
         (use reverse=True for descending).
+        (Sorts the set on every call. Use Universe.arriving_fleets() for lookups by destination and turn.)
         """
 
         turn_getter = attrgetter("turns_remaining")
@@ -43,7 +49,7 @@ class Fleets(TypedSetBase):
     def effective_ship_count_at_destinations(self):
         """Returns the fleets effective ship count (i.e. taking the planets growth into account) once they reach the destination.
 
-        (Currently doesn't account for multiple fleets arriving on the same turn)"""
+        (Currently doesn't account for multiple fleets arriving on the same turn. Use Universe.timeline() for an exact projection.)"""
         destinations = defaultdict(int)
         for turns, fleets in self.arrivals():
             for fleet in fleets:
@@ -54,3 +60,6 @@ class Fleets(TypedSetBase):
                 elif fleet.owner != fleet.destination.owner:
                     destinations[fleet.destination] += fleet.ship_count - fleet.destination.growth_rate * fleet.turns_remaining
         return destinations
+
+# Query results (@see Universe.find_fleets). Defined at import so they can be unpickled.
+ReadOnlyFleets = _read_only_class(Fleets)
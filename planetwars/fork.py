@@ -0,0 +1,154 @@
+"""Copy-on-write universe forks for what-if search.
+
+A fork is a sandboxed view of the universe that can be changed without touching the real game state:
+>>> fork = universe.fork()
+>>> fork.send_fleet(my_planet, target, 20)
+>>> fork.advance(10)
+>>> fork.owner(target)
+This would return the Player owning <target> 10 turns after sending the fleet.
+
+Creating a fork is O(1): all forks of one game state share a read-only snapshot of it (ForkBase) and only
+store the planets and fleets that changed (as overlays). Forking a fork copies just these overlays.
+Orders sent on a fork before advancing it are collected in the fork's own OrderBuffer (fork.orders) and can
+be sent for real with commit().
+"""
+from planetwars.orders import OrderBuffer
+from planetwars.player import Player, Players, PLAYER_MAP, NOBODY
+from planetwars.simulation import resolve_battle
+from planetwars.util import SET_TYPES
+
+def _owner_mask(owner):
+    if isinstance(owner, Player):
+        return 1 << owner.id
+    return Players(owner).mask
+
+
+class ForkBase(object):
+    """Read-only snapshot of a universe shared by all its forks (of one game state version)."""
+    def __init__(self, universe):
+        self.universe = universe
+        self.version = universe.version
+        self.planets = [universe._planets[id] for id in xrange(len(universe._planets))]
+        self.owners = [planet.owner.id for planet in self.planets]
+        self.ship_counts = [planet.ship_count for planet in self.planets]
+        self.growth_rates = [planet.growth_rate for planet in self.planets]
+        # (owner, ship_count, arrival turn) of all fleets in flight
+        self.fleets = []
+        # arrival turn -> list of (destination, owner, ship_count)
+        self.arrivals = {}
+        for fleet in universe.fleets:
+            self.fleets.append((fleet.owner.id, fleet.ship_count, fleet.turns_remaining))
+            self.arrivals.setdefault(fleet.turns_remaining, []).append(
+                (fleet.destination.id, fleet.owner.id, fleet.ship_count))
+
+
+class UniverseFork(object):
+    """Sandboxed copy of a universe (@see module docstring). Create it with Universe.fork() or fork()."""
+    def __init__(self, base, parent=None):
+        self._base = base
+        if parent is None:
+            # Number of turns this fork has been advanced
+            self.turn = 0
+            # planet id -> owner id / ship count of the planets that differ from the base
+            self._owners = {}
+            self._ship_counts = {}
+            # (owner, ship_count, destination, arrival turn) of the fleets sent on this fork
+            self._fleets = []
+            self.orders = OrderBuffer()
+        else:
+            self.turn = parent.turn
+            self._owners = parent._owners.copy()
+            self._ship_counts = parent._ship_counts.copy()
+            self._fleets = list(parent._fleets)
+            self.orders = parent.orders.copy()
+
+    def fork(self):
+        """Returns a fork of this fork."""
+        return UniverseFork(self._base, self)
+
+    @property
+    def universe(self):
+        return self._base.universe
+
+    def owner(self, planet):
+        """Returns the Player owning <planet> in this fork."""
+        return PLAYER_MAP[self._owners.get(planet.id, self._base.owners[planet.id])]
+
+    def ship_count(self, planet):
+        """Returns the ship count of <planet> in this fork."""
+        return self._ship_counts.get(planet.id, self._base.ship_counts[planet.id])
+
+    def find_planets(self, owner):
+        """Returns a list of all planets owned by <owner> (a Player or Players) in this fork."""
+        mask = _owner_mask(owner)
+        owners = self._owners
+        base_owners = self._base.owners
+        return [planet for planet in self._base.planets
+                if mask >> owners.get(planet.id, base_owners[planet.id]) & 1]
+
+    def total_ship_count(self, owner):
+        """Returns the number of ships (on planets and in flight) of <owner> (a Player or Players)."""
+        mask = _owner_mask(owner)
+        total = sum([self.ship_count(planet) for planet in self.find_planets(owner)])
+        total += sum([ship_count for fleet_owner, ship_count, arrival in self._base.fleets
+                      if arrival > self.turn and mask >> fleet_owner & 1])
+        total += sum([ship_count for fleet_owner, ship_count, _, _ in self._fleets if mask >> fleet_owner & 1])
+        return total
+
+    def total_growth_rate(self, owner):
+        """Returns the combined growth rate of all planets of <owner> (a Player or Players)."""
+        return sum([planet.growth_rate for planet in self.find_planets(owner)])
+
+    def send_fleet(self, source, destination, ship_count):
+        """Send a fleet (owned by the owner of <source> in this fork). Also accepts a set of destinations.
+        Returns False (and sends nothing) if <source> doesn't have enough ships."""
+        if isinstance(destination, SET_TYPES):
+            destinations = list(destination)
+        else:
+            destinations = [destination]
+        available = self.ship_count(source)
+        if ship_count * len(destinations) > available:
+            return False
+        self._ship_counts[source.id] = available - ship_count * len(destinations)
+        owner = self._owners.get(source.id, self._base.owners[source.id])
+        distances = self._base.universe.distances[source.id]
+        for target in destinations:
+            self._fleets.append((owner, ship_count, target.id, self.turn + distances[target.id]))
+            if not self.turn:
+                self.orders.send_fleet(source.id, target.id, ship_count)
+        return True
+
+    def advance(self, turns=1):
+        """Simulate <turns> turns (growth, fleet movement and battles). Returns the fork."""
+        base = self._base
+        owners = self._owners
+        ship_counts = self._ship_counts
+        for _ in xrange(turns):
+            self.turn += 1
+            turn = self.turn
+            for id, growth_rate in enumerate(base.growth_rates):
+                if growth_rate and owners.get(id, base.owners[id]) != NOBODY.id:
+                    ship_counts[id] = ship_counts.get(id, base.ship_counts[id]) + growth_rate
+            arrivals = {}
+            for destination, owner, ship_count in base.arrivals.get(turn, ()):
+                forces = arrivals.setdefault(destination, {})
+                forces[owner] = forces.get(owner, 0) + ship_count
+            if self._fleets:
+                in_flight = []
+                for fleet in self._fleets:
+                    owner, ship_count, destination, arrival = fleet
+                    if arrival > turn:
+                        in_flight.append(fleet)
+                        continue
+                    forces = arrivals.setdefault(destination, {})
+                    forces[owner] = forces.get(owner, 0) + ship_count
+                self._fleets = in_flight
+            for id, forces in arrivals.iteritems():
+                owners[id], ship_counts[id] = resolve_battle(
+                    owners.get(id, base.owners[id]), ship_counts.get(id, base.ship_counts[id]), forces)
+        return self
+
+    def commit(self):
+        """Send the orders issued on this fork before it was advanced for real (via Universe.send_fleets).
+        Returns the created Fleets."""
+        return self._base.universe.send_fleets(self.orders.orders())
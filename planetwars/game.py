@@ -3,10 +3,15 @@ import logging
 import signal
 from planetwars.universe import Universe
 from planetwars.util import timeout_handler, TimeIsUp
+from planetwars.stats import TurnStats
+from planetwars.budget import TimeBudget
+from planetwars.replay import GameRecorder
+from planetwars.orders import OrderBuffer
+from planetwars.ponder import PonderThread
+from planetwars.mapcache import MapCache
+from planetwars import trace
 from time import time
 from optparse import OptionParser
-from planetwars.planet import Planet
-from planetwars.fleet import Fleet
 
 log = logging.getLogger(__name__)
 
@@ -18,6 +23,30 @@ parser.add_option("--level", dest="loglevel", default="DEBUG", type="choice",
                   help="Only log messages of LOGLEVEL or higher importance. "
                        "Valid levels are: DEBUG, INFO, WARNING, ERROR, FATAL. "
                        "Defaults to DEBUG.", metavar="LOGLEVEL")
+parser.add_option("--stats", dest="statsfile", default=False,
+                  help="Write per turn phase timings as JSON to FILE at the end of the game", metavar="FILE")
+parser.add_option("--record", dest="recordfile", default=False,
+                  help="Record the game state and orders of every turn to FILE (@see replay.py)", metavar="FILE")
+parser.add_option("--map-cache", dest="mapcache", default=False,
+                  help="Cache map-static data (distances, bot static data) in DIR (@see mapcache.py)", metavar="DIR")
+parser.add_option("--trace", dest="tracefile", default=False,
+                  help="Trace into an in-memory ring buffer and append it to FILE on exceptions, "
+                       "timeouts and at the end of the game (@see trace.py)", metavar="FILE")
+
+# psyco is only probed once per process (@see _enable_psyco)
+_psyco_checked = False
+
+def _enable_psyco():
+    global _psyco_checked
+    if _psyco_checked:
+        return
+    _psyco_checked = True
+    try:
+        #noinspection PyUnresolvedReferences
+        import psyco
+        psyco.full()
+    except ImportError:
+        pass
 
 class Game(object):
     """The Game object talks to the tournament engine and updates the universe.
@@ -31,19 +60,57 @@ class Game(object):
 
     The timeout parameter specifies after which amout of time (in seconds) a TimeIsUp
     exception will be raised (by default this will abort the current turn and log a warning).
+    The bot also gets a TimeBudget (as self.budget, @see budget.py) for every turn that allows it to use
+    the available time cooperatively instead.
     This only works on platforms that support signal.SIGABRT (i.e. not windows) and on Python >= 2.6
     Unfortunately the tournament environment currently uses python 2.5 so you should not
     count on it beeing available.
+
+    stdin / stdout default to the process's streams and args (the command-line options) to sys.argv.
+
+    If the bot has a ponder(stopped) method it is run in a background thread while the engine is busy
+    with the other players (@see ponder.py). Its result is handed to the next turn as bot.ponder_result.
     """
-    def __init__(self, bot_class, universe_class=Universe, planet_class=Planet, fleet_class=Fleet, timeout=0.95):
-        options, _ = parser.parse_args()
+    def __init__(self, bot_class, universe_class=Universe, planet_class=None, fleet_class=None, timeout=0.95,
+                 stdin=None, stdout=None, args=None):
+        options, _ = parser.parse_args(args)
 
+        # Streams to talk to the engine (e.g. a socket when running in a host, @see host.py)
+        self.stdin = stdin or sys.stdin
+        self.stdout = stdout or sys.stdout
         self.logging_enabled = bool(options.logfile)
-        self.universe = universe_class(self, planet_class=planet_class, fleet_class=fleet_class)
+        self.trace_file = options.tracefile
+        # This game's own TraceRing (@see trace.py)
+        self.trace = None
+        if self.trace_file:
+            self.trace = trace.TraceRing()
+        self.stats_file = options.statsfile
+        # Only pass planet / fleet classes on if given so that universe classes can choose their own defaults
+        universe_kwargs = {}
+        if planet_class is not None:
+            universe_kwargs["planet_class"] = planet_class
+        if fleet_class is not None:
+            universe_kwargs["fleet_class"] = fleet_class
+        self.universe = universe_class(self, **universe_kwargs)
+        self.universe.trace = self.trace
+        if options.mapcache:
+            self.universe.map_cache = MapCache(options.mapcache)
         self.bot = bot_class(self.universe)
         self.timeout = timeout
+        self.stats = TurnStats(timeout)
         self.turn_count = 0
-        self._fleets_to_send = {}
+        self.orders = OrderBuffer()
+        self._state_lines = []
+        self._state_start = None
+        self.recorder = None
+        if options.recordfile:
+            self.recorder = GameRecorder(options.recordfile)
+        # State lines of the current turn (kept for the recorder)
+        self._turn_state = None
+        self._ponder = getattr(self.bot, "ponder", None)
+        self._ponder_thread = None
+        # Maximum time to wait for ponder() to return once the next state has arrived
+        self.ponder_timeout = timeout * 0.1
 
         if self.logging_enabled:
             logging.basicConfig(filename=options.logfile, level=getattr(logging, options.loglevel), format="%(asctime)s %(levelname)s: %(message)s")
@@ -56,70 +123,138 @@ class Game(object):
         except AttributeError:
             # signal.SIGALRM not supported on this platform
             self.has_alarm = False
-        try:
-            #noinspection PyUnresolvedReferences
-            import psyco
-            psyco.full()
-        except ImportError:
-            pass
+        except ValueError:
+            # Not in the main thread (e.g. in a threading host)
+            self.has_alarm = False
+        _enable_psyco()
         self.main()
 
     def main(self):
         has_itimer = True
         try:
             while True:
-                if sys.stdin.closed:
+                if self.stdin.closed:
+                    break
+                line = self.stdin.readline()
+                if not line:
+                    # EOF - the engine is gone
                     break
-                line = sys.stdin.readline().strip()
+                line = line.strip()
                 if line.startswith("go"):
                     self.turn_count += 1
-                    log.info("=== TURN START === (Turn no: %d)" % self.turn_count)
+                    parse_start = time()
+                    # The engine's clock started when it sent the first line of the state
+                    state_start = self._state_start or parse_start
+                    self._state_start = None
+                    if self._ponder_thread is not None:
+                        self.bot.ponder_result = self._ponder_thread.finish(self.ponder_timeout)
+                        if not self._ponder_thread.isAlive():
+                            self._ponder_thread = None
+                        self.stats.add("ponder_join", time() - parse_start)
+                        parse_start = time()
+                    self.universe.update_state(self._state_lines)
+                    self._turn_state, self._state_lines = self._state_lines, []
+                    self.stats.add("parse", time() - parse_start)
+                    log.info("=== TURN START === (Turn no: %d)", self.turn_count)
+                    if self.trace is not None:
+                        self.trace.record("turn_start", self.turn_count, parse_start - state_start)
                     turn_start = time()
+                    budget = self.bot.budget = TimeBudget(self.timeout, start=state_start, universe=self.universe)
                     try:
                         if self.has_alarm and has_itimer:
-                            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+                            signal.setitimer(signal.ITIMER_REAL, max(self.timeout - (turn_start - state_start), 0.001))
                     except AttributeError:
                         has_itimer = False
                         log.warning("signal.setitimer() is not available. Automatic timeout protection disabled!")
+                    aborted = False
                     try:
                         self.bot.do_turn()
                     except TimeIsUp:
+                        aborted = True
                         # Fallback in case bot doesn't catch it
                         log.warning("Bot failed to catch TimeIsUp exception!")
-                        pass
+                        self.dump_trace("TimeIsUp in turn %d" % self.turn_count)
                     except:
+                        self.dump_trace("Exception in bot.do_turn() in turn %d" % self.turn_count)
                         if not self.logging_enabled:
                             raise
                         log.error("Exception in bot.do_turn()", exc_info=True)
                     if self.has_alarm and has_itimer:
                         signal.setitimer(signal.ITIMER_REAL, 0)
-                    log.info("### TURN END ### (time taken: %0.4f s)" % (time() - turn_start, ))
+                    budget.send_best_orders(aborted)
+                    self.stats.add("do_turn", time() - turn_start)
+                    log.info("### TURN END ### (time taken: %0.4f s)", time() - turn_start)
+                    if self.trace is not None:
+                        self.trace.record("turn_end", self.turn_count, time() - turn_start)
                     self.turn_done()
-                else:
-                    self.universe.update(line)
+                    log.debug("Turn phases: %r", self.stats.turns[-1])
+                    if self._ponder is not None:
+                        if self._ponder_thread is None:
+                            self._ponder_thread = PonderThread(self._ponder)
+                            self._ponder_thread.start()
+                        else:
+                            # Never run two ponder() calls at once
+                            log.warning("bot.ponder() is still running - not pondering this turn")
+                elif line:
+                    if self._state_start is None:
+                        self._state_start = time()
+                        if self._ponder_thread is not None:
+                            self._ponder_thread.stop()
+                    self._state_lines.append(line)
         except KeyboardInterrupt:
             # exit
             pass
         except:
             # This should not happen, but just in case
+            self.dump_trace("Error in game engine in turn %d" % self.turn_count)
             if not self.logging_enabled:
                 raise
             log.fatal("Error in game engine! Report at http://github.com/ulope/planetwars-python-kit/issues", exc_info=True)
-        log.info("########### GAME END ########### (Turn count: %d)" % self.turn_count)
-        
+        if self._ponder_thread is not None:
+            self._ponder_thread.finish(self.ponder_timeout)
+        log.info("########### GAME END ########### (Turn count: %d)", self.turn_count)
+        turn_time = self.stats.turn_time
+        if len(turn_time):
+            log.info("Turn time: p50 %0.4f s, p95 %0.4f s, p99 %0.4f s, max %0.4f s",
+                     turn_time.percentile(50), turn_time.percentile(95), turn_time.percentile(99), turn_time.max)
+        if self.stats_file:
+            self.stats.write_report(self.stats_file)
+        if self.recorder:
+            self.recorder.close()
+        self.dump_trace("Game end after %d turns" % self.turn_count)
+        self.universe.teardown()
+
+    def dump_trace(self, reason):
+        """Append the trace events since the last dump to the trace file (if tracing is enabled)."""
+        if not self.trace_file:
+            return
+        try:
+            trace.dump(self.trace_file, reason, self.trace)
+        except (IOError, OSError):
+            log.warning("Couldn't write the trace file", exc_info=True)
 
     def send_fleet(self, source_id, destination_id, ship_count):
         """Record fleets to send so we can aggregate them."""
-        key = "%d.%d" % (source_id, destination_id)
-        if key in self._fleets_to_send:
-            self._fleets_to_send[key][2] += ship_count
-        else:
-            self._fleets_to_send[key] = [source_id, destination_id, ship_count]
+        self.orders.send_fleet(source_id, destination_id, ship_count)
+
+    def send_fleets(self, orders):
+        """Record a batch of (source_id, destination_id, ship_count) orders."""
+        self.orders.send_fleets(orders)
+
+    def clear(self):
+        """Forget the orders recorded this turn."""
+        self.orders.clear()
 
     def turn_done(self):
-        for source_id, destination_id, ship_count in self._fleets_to_send.values():
-            sys.stdout.write("%d %d %d\n" % (source_id, destination_id, ship_count))
-        self._fleets_to_send = {}
-        sys.stdout.write("go\n")
-        sys.stdout.flush()
+        flush_start = time()
+        orders = self.recorder and self.orders.orders()
+        self.orders.write(self.stdout)
+        self.orders.clear()
+        self.stdout.flush()
+        universe_start = time()
+        self.stats.add("flush", universe_start - flush_start)
         self.universe.turn_done()
+        self.stats.add("universe_turn_done", time() - universe_start)
+        self.stats.turn_done()
+        if self.recorder:
+            self.recorder.record_turn(self._turn_state, orders)
@@ -0,0 +1,118 @@
+"""Multi-game host.
+
+Runs one long-lived process that plays many games concurrently over Unix or TCP sockets - one Universe and
+one bot instance per connection. This saves the interpreter startup and warm-up (imports, class creation)
+of every single game. The engine talks to a thin shim (@see shim.py) that forwards stdin / stdout to the host:
+
+python -m planetwars.host mybot:MyBot --listen unix:/tmp/mybot.sock
+java -jar tools/PlayGame.jar maps/map7.txt 1000 200 log.txt "python planetwars/shim.py unix:/tmp/mybot.sock" ...
+
+By default every connection is served by a forked child of the (warm) host process, so each game is fully
+isolated and the SIGALRM timeout protection keeps working. With --threading games run in threads of the host
+instead; bots then have to rely on their TimeBudget (@see budget.py) since signals only work in the main thread.
+
+Options after "--" are passed on to every Game (e.g. "-- --stats stats.json").
+"""
+import os
+import sys
+import SocketServer
+from logging import getLogger
+from optparse import OptionParser
+from planetwars.game import Game
+from planetwars.universe import Universe
+
+log = getLogger(__name__)
+
+def parse_address(address):
+    """Parse "unix:PATH" or "[HOST:]PORT". Returns (family, address) with family "unix" or "tcp"."""
+    if address.startswith("unix:"):
+        return "unix", address[5:]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+class GameHandler(SocketServer.StreamRequestHandler):
+    """Plays one game per connection."""
+    def handle(self):
+        server = self.server
+        try:
+            Game(server.bot_class, universe_class=server.universe_class, timeout=server.timeout,
+                 stdin=self.rfile, stdout=self.wfile, args=server.game_args)
+        except Exception:
+            log.error("Game crashed", exc_info=True)
+
+
+class _ServerMixIn:
+    # SocketServer's classes are old-style classes - so is this one
+    allow_reuse_address = True
+    daemon_threads = True
+
+class ForkingUnixServer(_ServerMixIn, SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    pass
+
+class ThreadingUnixServer(_ServerMixIn, SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    pass
+
+class ForkingTCPServer(_ServerMixIn, SocketServer.ForkingMixIn, SocketServer.TCPServer):
+    pass
+
+class ThreadingTCPServer(_ServerMixIn, SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    pass
+
+SERVER_CLASSES = {
+    ("unix", False): ForkingUnixServer,
+    ("unix", True): ThreadingUnixServer,
+    ("tcp", False): ForkingTCPServer,
+    ("tcp", True): ThreadingTCPServer,
+}
+
+def make_server(bot_class, address, universe_class=Universe, timeout=0.95, threading=False, game_args=()):
+    """Create a server for <address> (@see parse_address) that plays a Game of <bot_class> on every connection.
+    <game_args> are the command-line options passed to every Game. Call serve_forever() on the result."""
+    family, address = parse_address(address)
+    if family == "unix" and os.path.exists(address):
+        os.unlink(address)
+    if not hasattr(os, "fork"):
+        threading = True
+    server = SERVER_CLASSES[(family, threading)](address, GameHandler)
+    server.bot_class = bot_class
+    server.universe_class = universe_class
+    server.timeout = timeout
+    server.game_args = list(game_args)
+    return server
+
+def main(args=None):
+    from planetwars.tournament import load_bot_class
+    if args is None:
+        args = sys.argv[1:]
+    game_args = []
+    if "--" in args:
+        game_args = args[args.index("--") + 1:]
+        args = args[:args.index("--")]
+    parser = OptionParser(usage="%prog [options] module:BotClass [-- game options]")
+    parser.add_option("--listen", dest="listen", default="unix:planetwars.sock",
+                      help="Address to listen on: unix:PATH or [HOST:]PORT. Defaults to unix:planetwars.sock.",
+                      metavar="ADDRESS")
+    parser.add_option("-u", "--universe", dest="universe", default=None,
+                      help="Universe class to use (module:Class).", metavar="CLASS")
+    parser.add_option("-t", "--timeout", dest="timeout", type="float", default=0.95,
+                      help="Turn timeout in seconds. Defaults to 0.95.")
+    parser.add_option("--threading", dest="threading", action="store_true", default=False,
+                      help="Serve games in threads instead of forked processes.")
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("Need exactly one bot class.")
+    sys.path.insert(0, os.getcwd())
+    universe_class = Universe
+    if options.universe:
+        universe_class = load_bot_class(options.universe)
+    server = make_server(load_bot_class(args[0]), options.listen, universe_class, options.timeout,
+                         options.threading, game_args)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""On-disk cache of map-static data.
+
+Contest maps repeat, so everything that only depends on the map (the planet positions and growth rates) can be
+computed once and reused by later games on the same map. Maps are identified by a fingerprint (sha1 of the
+static planet data in planet id order).
+
+Start a bot with "--map-cache DIR" (or set universe.map_cache yourself) to enable it. The cache holds:
+  - the distance table and neighbor order of the universe (raw native byte order int32 tables, read through mmap)
+  - static data of the bot (any picklable value, @see Universe.static_data)
+
+Layout: DIR/v<CACHE_VERSION>/<fingerprint>/tables.bin and static-<name>.pickle
+Files are written to a temporary file and renamed, so concurrent games never see partial files.
+"""
+import cPickle
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from logging import getLogger
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+log = getLogger(__name__)
+
+# Bump whenever the content or format of cached data changes
+CACHE_VERSION = 1
+
+TABLES_MAGIC = "PWMC"
+# magic, planet count
+TABLES_HEADER = struct.Struct("<4sI")
+INT32_SIZE = 4
+
+def map_fingerprint(planets):
+    """Returns the fingerprint of the map made of <planets> (in planet id order)."""
+    digest = sha1()
+    for planet in planets:
+        digest.update("%r %r %d\n" % (planet.position[0], planet.position[1], planet.growth_rate))
+    return digest.hexdigest()
+
+def _int32_array(values=()):
+    # array's "i" is int32 on all supported platforms
+    return array("i", values)
+
+
+class MapCache(object):
+    """A versioned on-disk cache directory (@see module docstring)."""
+    def __init__(self, directory):
+        self.directory = os.path.join(directory, "v%d" % CACHE_VERSION)
+
+    def _path(self, fingerprint, filename):
+        return os.path.join(self.directory, fingerprint, filename)
+
+    def _write(self, path, data):
+        """Write <data> to <path> atomically."""
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by a concurrent game
+                if not os.path.isdir(directory):
+                    raise
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        os.rename(temp_path, path)
+
+    def load_tables(self, fingerprint, planet_count):
+        """Returns the (distances, neighbors) tables (lists of int32 arrays) of a map or None on a miss."""
+        path = self._path(fingerprint, "tables.bin")
+        try:
+            table_file = open(path, "rb")
+        except IOError:
+            return None
+        try:
+            size = os.fstat(table_file.fileno()).st_size
+            row_size = planet_count * INT32_SIZE
+            neighbor_row_size = max(planet_count - 1, 0) * INT32_SIZE
+            if size != TABLES_HEADER.size + planet_count * (row_size + neighbor_row_size):
+                log.warning("Ignoring map cache file '%s' with unexpected size" % (path, ))
+                return None
+            data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                magic, count = TABLES_HEADER.unpack_from(data, 0)
+                if magic != TABLES_MAGIC or count != planet_count:
+                    log.warning("Ignoring invalid map cache file '%s'" % (path, ))
+                    return None
+                position = TABLES_HEADER.size
+                distances = []
+                for _ in xrange(planet_count):
+                    row = _int32_array()
+                    row.fromstring(data[position:position + row_size])
+                    distances.append(row)
+                    position += row_size
+                neighbors = []
+                for _ in xrange(planet_count):
+                    row = _int32_array()
+                    row.fromstring(data[position:position + neighbor_row_size])
+                    neighbors.append(row)
+                    position += neighbor_row_size
+            finally:
+                data.close()
+        finally:
+            table_file.close()
+        return distances, neighbors
+
+    def store_tables(self, fingerprint, distances, neighbors):
+        """Store the distances and neighbors tables of a map."""
+        chunks = [TABLES_HEADER.pack(TABLES_MAGIC, len(distances))]
+        chunks.extend([_int32_array(row).tostring() for row in distances])
+        chunks.extend([_int32_array(row).tostring() for row in neighbors])
+        self._write(self._path(fingerprint, "tables.bin"), "".join(chunks))
+
+    def load_static(self, fingerprint, name):
+        """Returns a (found, value) tuple of the static data <name> of a map."""
+        path = self._path(fingerprint, "static-%s.pickle" % name)
+        try:
+            static_file = open(path, "rb")
+        except IOError:
+            return False, None
+        try:
+            return True, cPickle.load(static_file)
+        except Exception:
+            log.warning("Ignoring unreadable map cache file '%s'" % (path, ), exc_info=True)
+            return False, None
+        finally:
+            static_file.close()
+
+    def store_static(self, fingerprint, name, value):
+        """Store the static data <name> of a map."""
+        self._write(self._path(fingerprint, "static-%s.pickle" % name), cPickle.dumps(value, 2))
@@ -0,0 +1,55 @@
+# Orders are aggregated by (source_id << KEY_SHIFT) | destination_id
+KEY_SHIFT = 16
+
+class OrderBuffer(object):
+    """Collects the orders issued during one turn.
+    Orders with the same source and destination are aggregated into one order (as the game would do anyway).
+
+    An OrderBuffer can be used as the 'game' of a Universe that isn't connected to the tournament engine
+    (e.g. in the in-process engine, @see engine.py).
+    """
+    def __init__(self):
+        self._orders = {}
+
+    def send_fleet(self, source_id, destination_id, ship_count):
+        """Record an order."""
+        key = source_id << KEY_SHIFT | destination_id
+        order = self._orders.get(key)
+        if order is None:
+            self._orders[key] = [source_id, destination_id, ship_count]
+        else:
+            order[2] += ship_count
+
+    def send_fleets(self, orders):
+        """Record a batch of (source_id, destination_id, ship_count) orders."""
+        recorded = self._orders
+        for source_id, destination_id, ship_count in orders:
+            key = source_id << KEY_SHIFT | destination_id
+            order = recorded.get(key)
+            if order is None:
+                recorded[key] = [source_id, destination_id, ship_count]
+            else:
+                order[2] += ship_count
+
+    def orders(self):
+        """Returns a list of (source_id, destination_id, ship_count) tuples of all recorded orders."""
+        return [tuple(order) for order in self._orders.itervalues()]
+
+    def write(self, stream):
+        """Write all recorded orders followed by "go" to <stream> (in the engine's format) with a single write."""
+        lines = ["%d %d %d\n" % tuple(order) for order in self._orders.itervalues()]
+        lines.append("go\n")
+        stream.write("".join(lines))
+
+    def copy(self):
+        """Returns a new OrderBuffer with the same orders."""
+        result = OrderBuffer()
+        result._orders = dict([(key, list(order)) for key, order in self._orders.iteritems()])
+        return result
+
+    def clear(self):
+        """Forget all recorded orders."""
+        self._orders = {}
+
+    def __len__(self):
+        return len(self._orders)
@@ -1,18 +1,19 @@
 from planetwars.player import PLAYER_MAP
-from planetwars.util import Point, TypedSetBase
+from planetwars.util import Point, BitSetBase, SET_TYPES, _read_only_class
+from itertools import islice, takewhile
 from math import ceil, sqrt
 import player
 
-_dist_cache = {}
+def point_distance(a, b):
+    """Returns the (rounded up) distance between two points as used by the game engine."""
+    dx = a[0] - b[0]
+    dy = a[1] - b[1]
+    return int(ceil(sqrt(dx ** 2 + dy ** 2)))
 
-class Planet(object):
-    def __init__(self, universe, id, x, y, owner, ship_count, growth_rate):
-        self.universe = universe
-        self.id = int(id)
-        self.position = Point(float(x), float(y))
-        self.owner = PLAYER_MAP.get(int(owner))
-        self.ship_count = int(ship_count)
-        self.growth_rate = int(growth_rate)
+class BasePlanet(object):
+    """Behaviour shared by all planet implementations. Subclasses provide the universe, id, position,
+    owner, ship_count and growth_rate attributes (@see Planet and arrays.ArrayPlanet)."""
+    __slots__ = ()
 
     def __repr__(self):
         return "<P(%d) #%d +%d>" % (self.id, self.ship_count, self.growth_rate)
@@ -22,30 +23,50 @@ class Planet(object):
         self.ship_count = int(ship_count)
 
     def distance(self, other):
-        """Returns the distance to <other>. <other> must be one of Planet instance, list, tuple or Point."""
-        if not (self, other) in _dist_cache:
-            if isinstance(other, Planet):
-                ox = other.position.x
-                oy = other.position.y
-            elif isinstance(other, (list, tuple)):
-                ox = other[0]
-                oy = other[1]
-            dx = self.position.x - ox
-            dy = self.position.y - oy
-            distance = int(ceil(sqrt(dx ** 2 + dy ** 2)))
-            _dist_cache[(self, other)] = distance
-            _dist_cache[(other, self)] = distance
-        return _dist_cache[(self, other)]
+        """Returns the distance to <other>. <other> must be one of Planet instance, list, tuple or Point.
+        Distances between planets are looked up in the universe's distance table (by planet id).
+        """
+        try:
+            return self._distances[other.id]
+        except (AttributeError, IndexError):
+            # Not a planet (or the distance table hasn't been built for it yet)
+            return point_distance(self.position, getattr(other, "position", other))
 
     __sub__ = distance
 
+    def neighbors(self, owner=None, growth_rate=None):
+        """Yields all other planets that satisfy the given conditions (@see Universe.find_planets)
+        ordered by distance (nearest first). Walks the precomputed neighbor order of this planet."""
+        self.universe._ensure_tables()
+        planets = self.universe._planets
+        if owner is None and growth_rate is None:
+            for id in self._neighbors:
+                yield planets[id]
+            return
+        mask = self.universe.find_planets(owner=owner, growth_rate=growth_rate).mask
+        if not mask:
+            return
+        for id in self._neighbors:
+            if mask >> id & 1:
+                yield planets[id]
+
     def find_nearest_neighbor(self, owner=None, growth_rate=None):
         """Find the nearest planet that satisfies the given conditions"""
-        candidates = self.universe.find_planets(owner=owner, growth_rate=growth_rate) - self
-        for planet in sorted(candidates, key=lambda p: p.distance(self)):
+        for planet in self.neighbors(owner, growth_rate):
             return planet
         return None
 
+    def nearest_neighbors(self, count, owner=None, growth_rate=None):
+        """Returns a list of the <count> nearest planets that satisfy the given conditions (nearest first)."""
+        return list(islice(self.neighbors(owner, growth_rate), count))
+
+    def neighbors_within(self, radius, owner=None, growth_rate=None):
+        """Returns a list of all planets at most <radius> turns away that satisfy the given conditions
+        (nearest first)."""
+        self.universe._ensure_tables()
+        distances = self._distances
+        return list(takewhile(lambda planet: distances[planet.id] <= radius, self.neighbors(owner, growth_rate)))
+
     @property
     def attacking_fleets(self):
         """Hostile (as seen from this planets owner) fleets en-route to this planet."""
@@ -65,7 +86,7 @@ class Planet(object):
         """Sends a fleet to target. Also accepts a set of targets.
         Returns the fleet(s) created by this action.
         """
-        if isinstance(target, set):
+        if isinstance(target, SET_TYPES):
             if self.ship_count >= ship_count * len(target):
                 return self.universe.send_fleet(self, target, ship_count)
         else:
@@ -73,12 +94,26 @@ class Planet(object):
                 return self.universe.send_fleet(self, target, ship_count)
         return None
 
-class Planets(TypedSetBase):
-    """Represents a set of Planet objects.
+class Planet(BasePlanet):
+    def __init__(self, universe, id, x, y, owner, ship_count, growth_rate):
+        self.universe = universe
+        self.id = int(id)
+        self.position = Point(float(x), float(y))
+        self.owner = PLAYER_MAP.get(int(owner))
+        self.ship_count = int(ship_count)
+        self.growth_rate = int(growth_rate)
+
+class Planets(BitSetBase):
+    """Represents a set of Planet objects (stored as a bitmask of planet ids).
     All normal set methods are available. Additionaly you can | (or) Planet objects directly into it.
     Some other convenience methods are available (see below).
     """
-    accepts = (Planet, )
+    __slots__ = ()
+    accepts = (BasePlanet, )
+
+    @classmethod
+    def _lookup_for(cls, element):
+        return element.universe._planets
 
     @property
     def ship_count(self):
@@ -90,4 +125,7 @@ class Planets(TypedSetBase):
         """Returns the combined growth rate of all Planet objects in this set"""
         return sum(p.growth_rate for p in self)
 
-    
\ No newline at end of file
+    
+
+# Query results (@see Universe.find_planets). Defined at import so they can be unpickled.
+ReadOnlyPlanets = _read_only_class(Planets)
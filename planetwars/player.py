@@ -1,4 +1,4 @@
-from planetwars.util import TypedSetBase
+from planetwars.util import BitSetBase, _read_only_class
 
 class Player(object):
     def __init__(self, id, name):
@@ -19,19 +19,21 @@ class Player(object):
         else:
             raise TypeError("Invalid operation for <Player> and %s" % type(other))
 
-class Players(TypedSetBase):
+class Players(BitSetBase):
+    """Set of Player objects (stored as a bitmask of player ids)."""
+    __slots__ = ()
     accepts = (Player, )
 
+    @classmethod
+    def _lookup_for(cls, element):
+        return PLAYER_MAP
+
 NOBODY = Player(0, "Nobody")
 ME = PLAYER1 = Player(1, "Me")
 PLAYER2 = Player(2, "Player 2")
 PLAYER3 = Player(3, "Player 3")
 PLAYER4 = Player(4, "Player 4")
 
-ENEMIES = Players([PLAYER2, PLAYER3, PLAYER4])
-NOT_ME = ENEMIES | NOBODY
-EVERYBODY = NOT_ME | ME
-
 PLAYER_MAP = {
     0: NOBODY,
     1: ME,
@@ -39,3 +41,10 @@ PLAYER_MAP = {
     3: PLAYER3,
     4: PLAYER4,
 }
+
+ReadOnlyPlayers = _read_only_class(Players)
+
+# Shared by all games in a process - so they are read-only
+ENEMIES = Players.read_only([PLAYER2, PLAYER3, PLAYER4])
+NOT_ME = Players.read_only(ENEMIES | NOBODY)
+EVERYBODY = Players.read_only(NOT_ME | ME)
@@ -0,0 +1,57 @@
+"""Background pondering while the engine is busy with the other players.
+
+A bot can define a ponder(stopped) method. If it does, Game runs it in a background thread from the moment
+the orders of a turn have been sent until the next state arrives. The universe is in the post-order state
+then (the bot's own fleets have been launched) and must not be changed by ponder().
+<stopped> is a threading.Event that gets set when the next state starts to arrive - ponder() should check it
+regularly and return as soon as it is set. Its return value is available as self.ponder_result in the next
+do_turn() (None if ponder() didn't return in time or raised an exception).
+Once <stopped> is set ponder() must not touch the universe any more: it is being updated with the next state.
+If ponder() keeps running anyway no new ponder() is started until it has returned.
+
+>>> def ponder(self, stopped):
+...     timelines = {}
+...     for turns in xrange(10, 50, 10):
+...         if stopped.isSet():
+...             break
+...         timelines[turns] = self.universe.timeline(turns)
+...     return timelines
+"""
+from logging import getLogger
+from threading import Thread, Event
+
+log = getLogger(__name__)
+
+class PonderThread(Thread):
+    """Runs <ponder>(stopped) in a daemon thread."""
+    def __init__(self, ponder):
+        Thread.__init__(self, name="ponder")
+        self.setDaemon(True)
+        self.ponder = ponder
+        self.stopped = Event()
+        self.result = None
+        # Set once ponder() didn't return within the timeout of finish()
+        self.overran = False
+
+    def run(self):
+        try:
+            self.result = self.ponder(self.stopped)
+        except Exception:
+            log.error("Exception in bot.ponder()", exc_info=True)
+
+    def stop(self):
+        """Ask ponder() to return."""
+        self.stopped.set()
+
+    def finish(self, timeout):
+        """Stop pondering and wait at most <timeout> seconds for ponder() to return (not again if it overran
+        an earlier finish()). Returns its result (None if it didn't return in time)."""
+        self.stop()
+        if self.overran:
+            return None
+        self.join(timeout)
+        if self.isAlive():
+            log.warning("bot.ponder() didn't return within %0.3f s after being stopped" % (timeout, ))
+            self.overran = True
+            return None
+        return self.result
@@ -0,0 +1,148 @@
+"""Compact game recordings.
+
+Start a bot with "--record FILE" to record every turn: the raw state lines sent by the engine (as seen by
+Universe.update_state) and the orders the bot sent in reply.
+
+File layout (all integers little endian):
+  header:   "PWRP", format version (uint16), reserved (uint16)
+  turns:    for every turn: blob length (uint32) + zlib compressed blob
+            (the state lines, an empty line and the "source destination ship_count" order lines)
+  index:    for every turn: blob offset (uint64) + blob length (uint32)
+  footer:   index offset (uint64), turn count (uint32), "PWRI"
+
+The index and footer are written when the recording is closed. Thanks to the fixed size index entries a
+single turn can be read through mmap without scanning the file. Recordings of games that crashed before
+the index was written are still readable (the turns are found by walking the length prefixes).
+
+Example:
+>>> replay = Replay("game.pwr")
+>>> universe = replay.universe(42)
+>>> state_lines, orders = replay.turn(42)
+"""
+import mmap
+import os
+import struct
+import zlib
+from planetwars.orders import OrderBuffer
+from planetwars.universe import Universe
+from planetwars.util import ParsingException
+
+MAGIC = "PWRP"
+INDEX_MAGIC = "PWRI"
+FORMAT_VERSION = 1
+# First byte of every zlib stream (deflate with a 32K window)
+ZLIB_HEADER = "x"
+
+HEADER = struct.Struct("<4sHH")
+BLOB_HEADER = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<QI")
+FOOTER = struct.Struct("<QI4s")
+
+
+def encode_turn(state_lines, orders):
+    """Returns the compressed blob of one turn."""
+    orders = ["%d %d %d" % tuple(order) for order in orders]
+    return zlib.compress("%s\n\n%s" % ("\n".join(state_lines), "\n".join(orders)))
+
+def decode_turn(blob):
+    """Returns the (state_lines, orders) of a blob created by encode_turn()."""
+    state, _, orders = zlib.decompress(blob).partition("\n\n")
+    state_lines = state and state.split("\n") or []
+    return state_lines, [tuple([int(value) for value in line.split()]) for line in orders.split("\n") if line]
+
+
+class GameRecorder(object):
+    """Writes a recording (@see module docstring). Call record_turn() once per turn and close() at the end."""
+    def __init__(self, filename):
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+        self.index = []
+
+    def record_turn(self, state_lines, orders):
+        """Record one turn. <orders> is a sequence of (source_id, destination_id, ship_count) tuples."""
+        blob = encode_turn(state_lines, orders)
+        offset = self.file.tell() + BLOB_HEADER.size
+        self.file.write(BLOB_HEADER.pack(len(blob)))
+        self.file.write(blob)
+        self.index.append((offset, len(blob)))
+
+    def close(self):
+        """Write the index and close the file."""
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write("".join([INDEX_ENTRY.pack(offset, length) for offset, length in self.index]))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+
+class Replay(object):
+    """Reads a recording made with GameRecorder. Turns are numbered from 1 (like Game.turn_count)."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            self._file.close()
+            raise ParsingException("'%s' is not a planetwars recording" % (filename, ))
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ParsingException("'%s' is not a planetwars recording of format version %d" % (filename, FORMAT_VERSION))
+        self._index_offset = None
+        self._index = None
+        if size >= HEADER.size + FOOTER.size:
+            index_offset, turn_count, index_magic = FOOTER.unpack_from(self._data, size - FOOTER.size)
+            if index_magic == INDEX_MAGIC:
+                self._index_offset = index_offset
+                self.turn_count = turn_count
+        if self._index_offset is None:
+            # Unfinished recording - find the turns by their length prefixes
+            self._index = self._scan(size)
+            self.turn_count = len(self._index)
+
+    def _scan(self, size):
+        index = []
+        position = HEADER.size
+        while position + BLOB_HEADER.size <= size:
+            length, = BLOB_HEADER.unpack_from(self._data, position)
+            position += BLOB_HEADER.size
+            if position + length > size or self._data[position:position + 1] != ZLIB_HEADER:
+                # Truncated blob or the start of a partly written index
+                break
+            index.append((position, length))
+            position += length
+        return index
+
+    def __len__(self):
+        return self.turn_count
+
+    def _blob(self, turn):
+        if not 1 <= turn <= self.turn_count:
+            raise IndexError("Turn %d not in recording (1 - %d)" % (turn, self.turn_count))
+        if self._index is not None:
+            offset, length = self._index[turn - 1]
+        else:
+            offset, length = INDEX_ENTRY.unpack_from(self._data, self._index_offset + (turn - 1) * INDEX_ENTRY.size)
+        return self._data[offset:offset + length]
+
+    def turn(self, turn):
+        """Returns the (state_lines, orders) of <turn>."""
+        return decode_turn(self._blob(turn))
+
+    def turns(self):
+        """Yields the (state_lines, orders) of all turns."""
+        for turn in xrange(1, self.turn_count + 1):
+            yield self.turn(turn)
+
+    def universe(self, turn, universe_class=Universe, **kwargs):
+        """Returns a new universe (of <universe_class>) in the state the bot saw at the start of <turn>.
+        Its 'game' is an OrderBuffer (@see orders.py). Keyword arguments are passed on to the universe."""
+        universe = universe_class(OrderBuffer(), **kwargs)
+        universe.update_state(self.turn(turn)[0])
+        return universe
+
+    def close(self):
+        self._data.close()
+        self._file.close()
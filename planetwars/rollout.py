@@ -0,0 +1,274 @@
+"""Parallel Monte Carlo rollouts.
+
+Plays random (or policy driven) games from the current state in a pool of worker processes and estimates
+the win rate of every root move (a list of (source, destination, ship_count) orders, an empty list means
+doing nothing):
+
+>>> rollouts = RolloutPool()
+>>> results = rollouts.evaluate(self.universe, root_moves, self.budget)
+>>> best = max(zip(results, root_moves))[1]
+
+The pool is persistent: create it in the bot's __init__ (before the first turn) so that the worker processes
+are started outside of any turn deadline. The workers keep the static map data (growth rates, distance and
+neighbor tables) resident: it is sent once per map. Every evaluate() pickles the dynamic state (owners, ship
+counts and fleets in flight) once and sends it to every worker together with all root moves. Each worker then
+plays the root moves round robin until the deadline. Call close() when the game is over.
+
+Rollouts stop at the deadline of the TimeBudget (@see budget.py, which is derived from Game.timeout) minus
+<margin> seconds. Workers check the deadline between playouts, so no worker keeps running into the next turn.
+
+A policy is a module level function (it has to be picklable) policy(state, player_id, random) that returns
+the orders of <player_id> for one turn as a list of (source_id, destination_id, ship_count) tuples
+(@see random_policy). Its <state> is a PlayoutState.
+"""
+import cPickle
+import random as _random
+import signal
+from logging import getLogger
+from time import time
+from planetwars.compat import namedtuple
+from planetwars.player import NOBODY
+from planetwars.simulation import resolve_battle
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python < 2.6
+    multiprocessing = None
+
+log = getLogger(__name__)
+
+
+class RolloutResult(namedtuple("RolloutResult", "win_rate playouts")):
+    """Outcome of the rollouts of one root move.
+    win_rate: wins / playouts (a draw counts as half a win), None if no playout finished in time.
+    playouts: number of finished playouts.
+    """
+
+
+class PlayoutState(object):
+    """Game state of one playout (inside a worker). Planets and players are plain ids."""
+    def __init__(self, static, owners, ship_counts, fleets):
+        self.growth_rates, self.distances, self.neighbors = static
+        self.owners = list(owners)
+        self.ship_counts = list(ship_counts)
+        # [owner, ship_count, destination, turns_remaining]
+        self.fleets = [list(fleet) for fleet in fleets]
+
+    def issue_orders(self, player_id, orders):
+        """Send the fleets of <orders>. Orders the player isn't allowed to give are skipped."""
+        for source, destination, ship_count in orders:
+            if self.owners[source] != player_id or not 0 < ship_count <= self.ship_counts[source] or \
+                    source == destination:
+                continue
+            self.ship_counts[source] -= ship_count
+            self.fleets.append([player_id, ship_count, destination, self.distances[source][destination]])
+
+    def advance(self):
+        """Advance by one turn: growth, fleet movement and battles (like engine.Match.advance)."""
+        ship_counts = self.ship_counts
+        for planet_id, owner in enumerate(self.owners):
+            if owner != NOBODY.id:
+                ship_counts[planet_id] += self.growth_rates[planet_id]
+        arrivals = {}
+        in_flight = []
+        for fleet in self.fleets:
+            fleet[3] -= 1
+            if fleet[3] > 0:
+                in_flight.append(fleet)
+            else:
+                forces = arrivals.setdefault(fleet[2], {})
+                forces[fleet[0]] = forces.get(fleet[0], 0) + fleet[1]
+        self.fleets = in_flight
+        for planet_id, forces in arrivals.iteritems():
+            self.owners[planet_id], ship_counts[planet_id] = resolve_battle(
+                self.owners[planet_id], ship_counts[planet_id], forces)
+
+    def players(self):
+        """Returns the set of players that still own planets or fleets."""
+        players = set(self.owners) | set([fleet[0] for fleet in self.fleets])
+        players.discard(NOBODY.id)
+        return players
+
+    def ship_count(self, player_id):
+        return sum([ship_count for owner, ship_count in zip(self.owners, self.ship_counts) if owner == player_id]) + \
+               sum([fleet[1] for fleet in self.fleets if fleet[0] == player_id])
+
+
+def random_policy(state, player_id, random, send_probability=0.3, nearest=5):
+    """Every planet of <player_id> sends half its ships to one of its <nearest> neighbors with
+    probability <send_probability>."""
+    orders = []
+    for planet_id, owner in enumerate(state.owners):
+        if owner != player_id or state.ship_counts[planet_id] < 2 or random.random() >= send_probability:
+            continue
+        neighbors = state.neighbors[planet_id]
+        if neighbors:
+            destination = neighbors[random.randrange(min(nearest, len(neighbors)))]
+            orders.append((planet_id, destination, state.ship_counts[planet_id] // 2))
+    return orders
+
+def playout(state, player_id, orders, policy, random, depth):
+    """Play one game from <state> (which gets changed) after <player_id> sent <orders>, for at most <depth> turns.
+    Returns 1.0 for a win of <player_id>, 0.5 for a draw and 0.0 for a loss (by ship count at the end)."""
+    for turn in xrange(depth):
+        players = state.players()
+        if len(players) <= 1:
+            break
+        for other in players:
+            if turn == 0 and other == player_id:
+                state.issue_orders(other, orders)
+            else:
+                state.issue_orders(other, policy(state, other, random))
+        state.advance()
+    players = state.players()
+    if player_id not in players:
+        return 0.0
+    own = state.ship_count(player_id)
+    best = max([state.ship_count(other) for other in players if other != player_id] or [-1])
+    if own > best:
+        return 1.0
+    if own == best:
+        return 0.5
+    return 0.0
+
+
+def _play(static, dynamic, player_id, root_moves, policy, depth, seed, deadline, quotas):
+    """Worker side: play the root moves round robin until the deadline or until every root move had its quota
+    of playouts (None for no limit). Returns a list of (score, playouts) per root move."""
+    random = _random.Random(seed)
+    owners, ship_counts, fleets = dynamic
+    results = [[0.0, 0] for _ in root_moves]
+    open_moves = [index for index in xrange(len(root_moves)) if quotas is None or quotas[index] > 0]
+    while open_moves and (deadline is None or time() < deadline):
+        for index in list(open_moves):
+            result = results[index]
+            result[0] += playout(PlayoutState(static, owners, ship_counts, fleets), player_id, root_moves[index],
+                                 policy, random, depth)
+            result[1] += 1
+            if quotas is not None and result[1] >= quotas[index]:
+                open_moves.remove(index)
+            if deadline is not None and time() >= deadline:
+                break
+    return [tuple(result) for result in results]
+
+def _worker(connection, policy, depth):
+    """Main loop of a worker process. Messages (pickled by the parent): ("map", static),
+    ("evaluate", state, seed, deadline, quotas) with the pickled (job, dynamic, player_id, root_moves) <state>
+    and ("stop", )."""
+    # The parent handles ctrl-c and SIGALRM (@see Game)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    static = None
+    while True:
+        message = cPickle.loads(connection.recv_bytes())
+        if message[0] == "map":
+            static = message[1]
+        elif message[0] == "evaluate":
+            state, seed, deadline, quotas = message[1:]
+            job, dynamic, player_id, root_moves = cPickle.loads(state)
+            connection.send_bytes(cPickle.dumps(
+                (job, _play(static, dynamic, player_id, root_moves, policy, depth, seed, deadline, quotas)), 2))
+        else:
+            break
+
+
+class RolloutPool(object):
+    """Persistent pool of rollout worker processes (@see module docstring). The workers are started right away.
+    <processes> defaults to the number of CPUs."""
+    def __init__(self, processes=None, policy=random_policy, depth=30, margin=0.05):
+        if multiprocessing is None:
+            raise ImportError("RolloutPool needs the multiprocessing module (Python 2.6+)")
+        self.processes = processes or multiprocessing.cpu_count()
+        self.margin = margin
+        self._fingerprint = None
+        self._job = 0
+        self._workers = []
+        for _ in xrange(self.processes):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(worker_connection, policy, depth))
+            process.daemon = True
+            process.start()
+            self._workers.append((process, connection))
+
+    def _broadcast(self, message):
+        data = cPickle.dumps(message, 2)
+        for _, connection in self._workers:
+            connection.send_bytes(data)
+
+    def _send_map(self, universe):
+        """Send the static map data to the workers (once per map)."""
+        if universe.map_fingerprint is not None and universe.map_fingerprint == self._fingerprint:
+            return
+        planets = [universe._planets[id] for id in xrange(len(universe._planets))]
+        self._broadcast(("map", ([planet.growth_rate for planet in planets], universe.distances,
+                                 universe.neighbors)))
+        self._fingerprint = universe.map_fingerprint
+
+    def evaluate(self, universe, root_moves, budget=None, max_playouts=None, player_id=1):
+        """Estimate the win rate of every root move (a list of (source, destination, ship_count) orders with
+        planets or planet ids) for <player_id> (by default ME).
+        Runs until <budget> (a TimeBudget) expires or every root move had <max_playouts> playouts (at least
+        one of them is required). Returns a list of RolloutResult in the order of <root_moves>."""
+        deadline = None
+        if budget is not None and budget.deadline is not None:
+            deadline = budget.deadline - self.margin
+        if deadline is None and max_playouts is None:
+            raise ValueError("Rollouts need a budget with a deadline or max_playouts")
+        self._send_map(universe)
+        planets = [universe._planets[id] for id in xrange(len(universe._planets))]
+        dynamic = ([planet.owner.id for planet in planets], [planet.ship_count for planet in planets],
+                   [(fleet.owner.id, fleet.ship_count, fleet.destination.id, fleet.turns_remaining)
+                    for fleet in universe.fleets])
+        root_moves = [[(getattr(source, "id", source), getattr(destination, "id", destination), int(ship_count))
+                       for source, destination, ship_count in orders] for orders in root_moves]
+        self._job += 1
+        seed = _random.randrange(1 << 30)
+        # The state is pickled once, each worker gets its share of max_playouts and its own seed
+        state = cPickle.dumps((self._job, dynamic, player_id, root_moves), 2)
+        for number, (_, connection) in enumerate(self._workers):
+            quotas = None
+            if max_playouts is not None:
+                share = max_playouts // self.processes + (number < max_playouts % self.processes)
+                quotas = [share] * len(root_moves)
+            connection.send_bytes(cPickle.dumps(("evaluate", state, seed + number, deadline, quotas), 2))
+        scores = [0.0] * len(root_moves)
+        playouts = [0] * len(root_moves)
+        late = 0
+        for _, connection in self._workers:
+            while True:
+                if deadline is not None and not connection.poll(max(deadline - time(), 0) + self.margin):
+                    # Out of time: the worker stops on its own, its result is dropped by a later evaluate()
+                    late += 1
+                    break
+                job, results = cPickle.loads(connection.recv_bytes())
+                if job != self._job:
+                    # Result of an earlier evaluate() that came in too late
+                    continue
+                for index, (score, count) in enumerate(results):
+                    scores[index] += score
+                    playouts[index] += count
+                break
+        if late:
+            log.debug("%d rollout workers missed the deadline", late)
+        results = []
+        for score, count in zip(scores, playouts):
+            if count:
+                results.append(RolloutResult(score / count, count))
+            else:
+                results.append(RolloutResult(None, 0))
+        return results
+
+    def close(self):
+        """Stop the worker processes."""
+        for process, connection in self._workers:
+            try:
+                connection.send_bytes(cPickle.dumps(("stop", ), 2))
+            except (IOError, OSError):
+                pass
+        for process, connection in self._workers:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self._workers = []
+        self._fingerprint = None
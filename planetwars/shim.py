@@ -0,0 +1,60 @@
+"""Connects the engine (stdin / stdout) to a game host (@see host.py).
+
+Run it as a script (not with -m) so that only the standard library gets imported:
+python planetwars/shim.py unix:/tmp/mybot.sock
+python planetwars/shim.py localhost:7000
+"""
+import os
+import select
+import socket
+import sys
+
+BUFFER_SIZE = 65536
+
+def connect(address):
+    """Connect to "unix:PATH" or "[HOST:]PORT"."""
+    if address.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[5:])
+    else:
+        host, _, port = address.rpartition(":")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.connect((host or "127.0.0.1", int(port)))
+    return sock
+
+def forward(sock, stdin_fd, stdout_fd):
+    """Forward everything from <stdin_fd> to <sock> and from <sock> to <stdout_fd> until the host is done."""
+    inputs = [stdin_fd, sock]
+    while True:
+        readable, _, _ = select.select(inputs, [], [])
+        if stdin_fd in readable:
+            data = os.read(stdin_fd, BUFFER_SIZE)
+            if data:
+                sock.sendall(data)
+            else:
+                # The engine closed our stdin - let the host know and wait for it to finish
+                sock.shutdown(socket.SHUT_WR)
+                inputs.remove(stdin_fd)
+        if sock in readable:
+            data = sock.recv(BUFFER_SIZE)
+            if not data:
+                break
+            while data:
+                data = data[os.write(stdout_fd, data):]
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 1:
+        sys.stderr.write("usage: shim.py unix:PATH|[HOST:]PORT\n")
+        return 2
+    sock = connect(args[0])
+    try:
+        forward(sock, sys.stdin.fileno(), sys.stdout.fileno())
+    finally:
+        sock.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+from planetwars.compat import namedtuple
+from planetwars.player import PLAYER_MAP, NOBODY
+
+def resolve_battle(owner, ship_count, forces):
+    """Resolves a battle on a planet according to the official game rules.
+
+    <owner> and <ship_count> describe the planets garrison (owner is a player id).
+    <forces> is a dict of player id -> ships arriving this turn.
+
+    The garrison joins the arriving ships of the same player. The largest force wins and keeps
+    the difference to the second largest force. If the two largest forces are equal the planet
+    keeps its owner with no ships left.
+
+    Returns a (owner, ship_count) tuple.
+    """
+    if not forces:
+        return owner, ship_count
+    forces = dict(forces)
+    forces[owner] = forces.get(owner, 0) + ship_count
+    if len(forces) == 1:
+        return owner, forces[owner]
+    winner, first, second = owner, -1, -1
+    for force_owner, ships in forces.iteritems():
+        if ships > first:
+            second = first
+            winner, first = force_owner, ships
+        elif ships > second:
+            second = ships
+    if first > second:
+        return winner, first - second
+    return owner, 0
+
+def project_planet(owner, ship_count, growth_rate, arrivals, turns, player_id=None):
+    """Projects a single planet over <turns> turns. <arrivals> is a dict of turn -> {owner id: ships}.
+    Returns (owners, ship_counts, lost): the owner ids and ship counts for turns 0 to <turns> and the
+    number of ships of <player_id> destroyed in battles on the planet.
+    """
+    owners = [owner]
+    ship_counts = [ship_count]
+    lost = 0
+    for turn in xrange(1, turns + 1):
+        if owner != NOBODY.id:
+            ship_count += growth_rate
+        forces = arrivals.get(turn)
+        if forces:
+            if player_id is not None:
+                force = forces.get(player_id, 0)
+                if owner == player_id:
+                    force += ship_count
+            owner, ship_count = resolve_battle(owner, ship_count, forces)
+            if player_id is not None:
+                lost += force - (owner == player_id and ship_count or 0)
+        owners.append(owner)
+        ship_counts.append(ship_count)
+    return owners, ship_counts, lost
+
+
+class Timeline(object):
+    """Projected future of all planets given the fleets currently in flight (ignoring any orders that
+    have not been sent yet).
+
+    The projection is computed for all planets in one pass when the Timeline is created.
+    Turn 0 is the current state, turn 1 the state after the next turn has been played etc.
+    If <turns> is not given the projection covers the turns until the last fleet has arrived.
+
+    Example:
+    >>> timeline = universe.timeline()
+    >>> timeline.owner(planet, 5)
+    This would return the Player that will own <planet> in 5 turns.
+    """
+
+    def __init__(self, universe, turns=None):
+        planets = [universe._planets[id] for id in xrange(len(universe._planets))]
+        fleets = universe.fleets
+        if turns is None:
+            turns = max([f.turns_remaining for f in fleets] or [0])
+        self.turns = turns
+
+        # Bucket all arriving fleets by destination, turn and owner
+        arrivals = [{} for _ in planets]
+        for fleet in fleets:
+            if fleet.turns_remaining > turns:
+                continue
+            forces = arrivals[fleet.destination.id].setdefault(fleet.turns_remaining, {})
+            forces[fleet.owner.id] = forces.get(fleet.owner.id, 0) + fleet.ship_count
+
+        # Kept for re-simulating single planets (@see score_orders)
+        self._planets = planets
+        self._arrivals = arrivals
+        self._owners = []
+        self._ship_counts = []
+        for planet, planet_arrivals in zip(planets, arrivals):
+            owners, ship_counts, _ = project_planet(planet.owner.id, planet.ship_count, planet.growth_rate,
+                                                    planet_arrivals, turns)
+            self._owners.append(owners)
+            self._ship_counts.append(ship_counts)
+
+    def owner(self, planet, turn):
+        """Returns the Player owning <planet> in <turn> turns."""
+        return PLAYER_MAP[self._owners[planet.id][turn]]
+
+    def ship_count(self, planet, turn):
+        """Returns the ship count of <planet> in <turn> turns."""
+        return self._ship_counts[planet.id][turn]
+
+    def owners(self, planet):
+        """Returns a list of the Players owning <planet> for every turn of the projection."""
+        return [PLAYER_MAP[owner] for owner in self._owners[planet.id]]
+
+    def ship_counts(self, planet):
+        """Returns a list of the ship counts of <planet> for every turn of the projection."""
+        return list(self._ship_counts[planet.id])
+
+
+class MoveScore(namedtuple("MoveScore", "owners ship_counts growth_gained ships_lost")):
+    """Outcome of a candidate set of orders at the end of the projection (@see Universe.score_moves).
+    owners / ship_counts: dicts of planet id -> Player / ship count for all planets touched by the orders
+        (all other planets end up as in the projection without the orders).
+    growth_gained: change of the player's total growth rate compared to not sending the orders.
+    ships_lost: change of the number of the player's ships destroyed in battles compared to not sending the orders.
+    """
+
+def score_orders(timeline, distances, orders, player_id, base_losses=None):
+    """Score a list of (source, destination, ship_count) orders (planets) against <timeline> (the projection
+    without them). Only the planets touched by the orders are re-simulated. Returns a MoveScore or None
+    if a source doesn't have enough ships.
+    <base_losses> (planet id -> ships of the player lost without the orders) can be shared between calls."""
+    if base_losses is None:
+        base_losses = {}
+    turns = timeline.turns
+    sent = {}
+    extra_arrivals = {}
+    for source, destination, ship_count in orders:
+        sent[source.id] = sent.get(source.id, 0) + ship_count
+        arrival = distances[source.id][destination.id]
+        if arrival > turns:
+            continue
+        forces = extra_arrivals.setdefault(destination.id, {}).setdefault(arrival, {})
+        owner = source.owner.id
+        forces[owner] = forces.get(owner, 0) + ship_count
+    planets = timeline._planets
+    for planet_id, ship_count in sent.iteritems():
+        if ship_count > planets[planet_id].ship_count:
+            return None
+    owners = {}
+    ship_counts = {}
+    growth_gained = 0
+    ships_lost = 0
+    for planet_id in set(sent) | set(extra_arrivals):
+        planet = planets[planet_id]
+        arrivals = timeline._arrivals[planet_id]
+        extra = extra_arrivals.get(planet_id)
+        if extra:
+            arrivals = dict(arrivals)
+            for turn, forces in extra.iteritems():
+                merged = dict(arrivals.get(turn, ()))
+                for owner, ship_count in forces.iteritems():
+                    merged[owner] = merged.get(owner, 0) + ship_count
+                arrivals[turn] = merged
+        planet_owners, planet_ship_counts, lost = project_planet(
+            planet.owner.id, planet.ship_count - sent.get(planet_id, 0), planet.growth_rate, arrivals, turns,
+            player_id)
+        if planet_id not in base_losses:
+            base_losses[planet_id] = project_planet(planet.owner.id, planet.ship_count, planet.growth_rate,
+                                                    timeline._arrivals[planet_id], turns, player_id)[2]
+        owner = planet_owners[-1]
+        base_owner = timeline._owners[planet_id][-1]
+        if owner == player_id and base_owner != player_id:
+            growth_gained += planet.growth_rate
+        elif owner != player_id and base_owner == player_id:
+            growth_gained -= planet.growth_rate
+        ships_lost += lost - base_losses[planet_id]
+        owners[planet_id] = PLAYER_MAP[owner]
+        ship_counts[planet_id] = planet_ship_counts[-1]
+    return MoveScore(owners, ship_counts, growth_gained, ships_lost)
@@ -0,0 +1,108 @@
+"""Per-turn timing instrumentation.
+
+Game records how long each phase of every turn takes:
+  parse:               Universe.update_state (the state sent by the engine)
+  do_turn:             the bot's do_turn()
+  flush:               writing the orders to the engine (Game.turn_done)
+  universe_turn_done:  Universe.turn_done bookkeeping (after the orders have been sent)
+  ponder_join:         waiting for bot.ponder() to return once the next state arrived (@see ponder.py)
+
+parse, do_turn, flush and ponder_join count against the turn timeout. The remaining time is tracked as "headroom".
+
+Start a bot with "--stats FILE" to get a JSON report at the end of the game.
+"""
+from planetwars.compat import json
+
+PHASES = ("parse", "do_turn", "flush", "universe_turn_done", "ponder_join")
+
+def _percentile(ordered, percent):
+    return ordered[int(round(percent / 100.0 * (len(ordered) - 1)))]
+
+class Histogram(object):
+    """Running distribution of (timing) samples."""
+    def __init__(self):
+        self.samples = []
+        self.total = 0.0
+        self.max = None
+        self.min = None
+
+    def add(self, value):
+        self.samples.append(value)
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, percent):
+        """Returns the (nearest rank) <percent> percentile of all samples."""
+        if not self.samples:
+            return None
+        return _percentile(sorted(self.samples), percent)
+
+    def summary(self):
+        """Returns a dict with count, mean, min, p50, p95, p99 and max."""
+        if not self.samples:
+            return {"count": 0}
+        ordered = sorted(self.samples)
+        return {
+            "count": len(ordered),
+            "mean": self.total / len(ordered),
+            "min": self.min,
+            "p50": _percentile(ordered, 50),
+            "p95": _percentile(ordered, 95),
+            "p99": _percentile(ordered, 99),
+            "max": self.max,
+        }
+
+
+class TurnStats(object):
+    """Phase timings of all turns of a game (@see PHASES)."""
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.phases = dict((phase, Histogram()) for phase in PHASES)
+        # Time used by the phases that count against the timeout
+        self.turn_time = Histogram()
+        self.headroom = Histogram()
+        self.turns = []
+        self._current = {}
+
+    def add(self, phase, seconds):
+        """Record the duration of <phase> for the current turn."""
+        self.phases[phase].add(seconds)
+        self._current[phase] = self._current.get(phase, 0.0) + seconds
+
+    def turn_done(self):
+        """Finish the current turn. Returns the time it took (without universe_turn_done)."""
+        current, self._current = self._current, {}
+        turn_time = sum([seconds for phase, seconds in current.iteritems() if phase != "universe_turn_done"])
+        self.turn_time.add(turn_time)
+        if self.timeout:
+            self.headroom.add(self.timeout - turn_time)
+        current["turn"] = len(self.turns) + 1
+        current["total"] = turn_time
+        self.turns.append(current)
+        return turn_time
+
+    def report(self):
+        """Returns a dict with summaries of all phases, the per turn time and headroom and the slowest turns."""
+        return {
+            "timeout": self.timeout,
+            "turn_count": len(self.turns),
+            "phases": dict((phase, histogram.summary()) for phase, histogram in self.phases.iteritems()),
+            "turn_time": self.turn_time.summary(),
+            "headroom": self.headroom.summary(),
+            "timeouts": len([turn for turn in self.turns if self.timeout and turn["total"] > self.timeout]),
+            "slowest_turns": sorted(self.turns, key=lambda turn: turn["total"], reverse=True)[:10],
+        }
+
+    def write_report(self, filename):
+        """Write the report as JSON to <filename>."""
+        report_file = open(filename, "w")
+        try:
+            json.dump(self.report(), report_file, indent=2, sort_keys=True)
+        finally:
+            report_file.close()
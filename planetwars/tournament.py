@@ -0,0 +1,165 @@
+"""Parallel tournament runner.
+
+Plays every pairing of a set of bots on every map in a directory (in both seat orders) using the
+in-process engine (@see engine.py) spread across a pool of worker processes.
+
+Example:
+>>> from planetwars.tournament import run_tournament
+>>> result = run_tournament([MyBot, MyOldBot, StupidBot], "maps/")
+>>> print result.summary()
+
+Bot classes have to be importable by the worker processes, i.e. they must be defined at module level in a
+module that doesn't start a Game when it's imported (guard it with "if __name__ == '__main__':").
+
+It can also be used from the command line (bots are given as module:Class):
+python -m planetwars.tournament maps/ mybot:MyBot mybot_old:MyBot stupidbot:StupidBot
+"""
+import os
+import sys
+from glob import glob
+from itertools import permutations
+from multiprocessing import Pool, cpu_count
+from optparse import OptionParser
+from time import time
+from planetwars.compat import namedtuple
+from planetwars.engine import play_match
+
+
+class GameRecord(namedtuple("GameRecord", "map_file bots winner turns duration dropped")):
+    """Result of one tournament game.
+    bots: the names of the bots in seat order (the first one was player 1).
+    winner: name of the winning bot or None for a draw.
+    duration: wall clock time (in seconds) the game took.
+    dropped: names of the bots that were dropped from the game.
+    """
+
+
+class BotStats(object):
+    """Aggregated results of one bot."""
+    def __init__(self, name):
+        self.name = name
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.dropped = 0
+        self.turns = 0
+
+    @property
+    def games(self):
+        return self.wins + self.losses + self.draws
+
+    @property
+    def win_rate(self):
+        if not self.games:
+            return 0.0
+        return float(self.wins) / self.games
+
+    @property
+    def average_turns(self):
+        if not self.games:
+            return 0.0
+        return float(self.turns) / self.games
+
+    def __repr__(self):
+        return "<BotStats %s: %d/%d/%d>" % (self.name, self.wins, self.losses, self.draws)
+
+
+class TournamentResult(object):
+    """All game records of a tournament and the stats aggregated from them."""
+    def __init__(self, records, duration):
+        self.records = records
+        self.duration = duration
+        self.stats = {}
+        for record in records:
+            for name in record.bots:
+                stats = self.stats.setdefault(name, BotStats(name))
+                stats.turns += record.turns
+                if record.winner is None:
+                    stats.draws += 1
+                elif record.winner == name:
+                    stats.wins += 1
+                else:
+                    stats.losses += 1
+                if name in record.dropped:
+                    stats.dropped += 1
+
+    def standings(self):
+        """Returns the BotStats of all bots ordered by win rate (best first)."""
+        return sorted(self.stats.values(), key=lambda stats: (stats.win_rate, stats.wins), reverse=True)
+
+    def summary(self):
+        """Returns a human readable table of the standings and timings."""
+        lines = ["%-30s %6s %6s %6s %6s %7s %7s" % ("Bot", "Games", "Wins", "Losses", "Draws", "Win %", "Turns")]
+        for stats in self.standings():
+            lines.append("%-30s %6d %6d %6d %6d %6.1f%% %7.1f" % (
+                stats.name, stats.games, stats.wins, stats.losses, stats.draws, stats.win_rate * 100,
+                stats.average_turns))
+        durations = sorted(record.duration for record in self.records)
+        if durations:
+            lines.append("")
+            lines.append("%d games in %0.2f s (per game: median %0.3f s, max %0.3f s)" % (
+                len(durations), self.duration, durations[len(durations) // 2], durations[-1]))
+        return "\n".join(lines)
+
+
+def bot_name(bot_class):
+    return "%s.%s" % (bot_class.__module__, bot_class.__name__)
+
+def _play_game(job):
+    map_file, bot_classes, match_kwargs = job
+    start = time()
+    result = play_match(map_file, bot_classes, **match_kwargs)
+    names = [bot_name(bot_class) for bot_class in bot_classes]
+    winner = None
+    if result.winner:
+        winner = names[result.winner - 1]
+    return GameRecord(map_file, names, winner, result.turns, time() - start,
+                      [names[player_id - 1] for player_id in result.dropped])
+
+def tournament_jobs(bot_classes, map_files, **match_kwargs):
+    """Returns a (map_file, bot_classes, match_kwargs) job for every pairing, map and seat order."""
+    return [(map_file, pairing, match_kwargs)
+            for map_file in map_files
+            for pairing in permutations(bot_classes, 2)]
+
+def run_tournament(bot_classes, maps, processes=None, **match_kwargs):
+    """Play a tournament between <bot_classes> on <maps> (a directory containing map files or a list of map files).
+    <processes> defaults to the number of cores. Keyword arguments are passed on to engine.Match.
+
+    Returns a TournamentResult.
+    """
+    if isinstance(maps, basestring):
+        maps = sorted(glob(os.path.join(maps, "*.txt")))
+    jobs = tournament_jobs(bot_classes, maps, **match_kwargs)
+    processes = processes or cpu_count()
+    start = time()
+    pool = Pool(processes)
+    try:
+        records = list(pool.imap_unordered(_play_game, jobs, max(1, len(jobs) // (processes * 4))))
+    finally:
+        pool.close()
+        pool.join()
+    return TournamentResult(records, time() - start)
+
+def load_bot_class(spec):
+    """Load a bot class given as "module:Class"."""
+    module_name, class_name = spec.split(":", 1)
+    module = __import__(module_name, {}, {}, [class_name])
+    return getattr(module, class_name)
+
+def main(args=None):
+    parser = OptionParser(usage="%prog [options] MAP_DIR module:BotClass module:BotClass [...]")
+    parser.add_option("-p", "--processes", dest="processes", type="int", default=None,
+                      help="Number of worker processes. Defaults to the number of cores.")
+    parser.add_option("-t", "--turns", dest="max_turns", type="int", default=200,
+                      help="Maximum number of turns per game. Defaults to 200.")
+    options, args = parser.parse_args(args)
+    if len(args) < 3:
+        parser.error("Need a map directory and at least two bots.")
+    sys.path.insert(0, os.getcwd())
+    result = run_tournament([load_bot_class(spec) for spec in args[1:]], args[0],
+                            processes=options.processes, max_turns=options.max_turns)
+    print result.summary()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Cheap structured tracing into an in-memory ring buffer.
+
+Trace events are (timestamp, name, args) tuples. They are recorded unformatted into a fixed size ring buffer
+and only formatted when the buffer is dumped (Game dumps it on exceptions, on TimeIsUp and at the end of the
+game; start a bot with "--trace FILE" to enable it).
+
+Every Game has its own ring (so games running side by side in a host don't mix their traces, @see host.py)
+and hands it to its universe as universe.trace. While tracing is disabled (the default) that is None and
+tracing costs a single attribute check:
+>>> trace = self.universe.trace
+>>> if trace is not None:
+...     trace.record("attack", planet.id, ship_count)
+
+The module level <ring> (@see enable) is only the default for universes created outside of a Game.
+"""
+import sys
+from time import time
+
+# Default number of events kept
+DEFAULT_SIZE = 4096
+
+# Default TraceRing of new universes or None
+ring = None
+
+
+class TraceRing(object):
+    """Fixed size ring buffer of trace events. Once it is full the oldest events are overwritten."""
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self._events = [None] * size
+        # Total number of events recorded so far / at the last dump
+        self.count = 0
+        self._dumped = 0
+
+    def record(self, name, *args):
+        """Record the event <name> with <args> (any values, formatted with repr() when dumped)."""
+        self._events[self.count % self.size] = (time(), name, args)
+        self.count += 1
+
+    def events(self, since=0):
+        """Returns the recorded events (oldest first) that are still in the buffer, starting from event number <since>."""
+        start = max(since, self.count - self.size, 0)
+        return [self._events[number % self.size] for number in xrange(start, self.count)]
+
+    def dump(self, stream, reason=""):
+        """Write the events recorded since the last dump to <stream> (one line per event)."""
+        events = self.events(self._dumped)
+        lost = max(self.count - self.size - self._dumped, 0)
+        self._dumped = self.count
+        lines = ["# trace dump: %s (%d events, %d overwritten)\n" % (reason, len(events), lost)]
+        for timestamp, name, args in events:
+            lines.append("%0.6f %s %s\n" % (timestamp, name, " ".join([repr(arg) for arg in args])))
+        stream.write("".join(lines))
+
+
+def enable(size=DEFAULT_SIZE):
+    """Make a new ring of <size> events the default of universes created from now on. Returns the ring."""
+    global ring
+    ring = TraceRing(size)
+    return ring
+
+def disable():
+    global ring
+    ring = None
+
+def dump(filename, reason="", trace_ring=None):
+    """Append the events <trace_ring> (by default the module level ring) recorded since its last dump to the
+    file <filename> (or "-" for stderr). Does nothing if there is no ring."""
+    if trace_ring is None:
+        trace_ring = ring
+    if trace_ring is None:
+        return
+    if filename == "-":
+        trace_ring.dump(sys.stderr, reason)
+        return
+    trace_file = open(filename, "a")
+    try:
+        trace_ring.dump(trace_file, reason)
+    finally:
+        trace_file.close()
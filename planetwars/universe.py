@@ -1,12 +1,33 @@
-from planetwars.util import ParsingException, _make_id, SetDict
-from planetwars.fleet import Fleet, Fleets
-from planetwars.planet import Planet, Planets
+from planetwars.util import ParsingException, InvalidOrders, SetDict, BitSetBase, SET_TYPES, deep_sizeof
+from planetwars.fleet import BaseFleet, Fleet, Fleets
+from planetwars.planet import BasePlanet, Planet, Planets, point_distance
 from planetwars import player
 from planetwars.player import Players
+from planetwars.simulation import Timeline, score_orders
+from planetwars.fork import ForkBase, UniverseFork
+from planetwars.mapcache import map_fingerprint
+from planetwars.events import PlanetCaptured, ShipDelta, FleetLaunched, FleetArrived, FleetDiscarded
+from planetwars import trace
 from logging import getLogger
+from array import array
 
 log = getLogger(__name__)
 
+# Maximum number of query results cached per game state version
+QUERY_CACHE_SIZE = 256
+
+def _query_key(value):
+    """Hashable cache key of a find_* argument (a single object, a set or any other iterable of objects)."""
+    if isinstance(value, BitSetBase):
+        return (type(value).__name__, value.mask)
+    if isinstance(value, (set, frozenset, list, tuple)):
+        return frozenset(value)
+    try:
+        hash(value)
+    except TypeError:
+        return frozenset(value)
+    return value
+
 class Universe(object):
     """'Main' planetwars object. The Universe knows about all planets and fleets and talks to the Game.
 
@@ -17,6 +38,9 @@ class Universe(object):
     >>> universe.find_fleets(owner=player.ENEMIES, destination=universe.find_planets(owner=player.ME, growth_rate=5))
     This would return all hostile fleets en route to any of 'my' 5-growth planets.
 
+    The sets returned by find_fleets / find_planets (and all convenience properties) are read-only and cached until
+    the game state changes. Use copy() if you need a modifiable set.
+
     The game objects are stable. That means you can keep references to Planet and Fleet objects in you own code and
     they will still be valid in the next turn (although fleets of course will expire once they reach their destination).
     """
@@ -26,10 +50,45 @@ class Universe(object):
         self.planet_class = planet_class
         self.fleet_class = fleet_class
         self._planets = {}
+        # Fleets bucketed by (owner, ship_count, source, destination, trip_length)
         self._fleets = {}
+        self.fleet_id = 0
+        # Number of fleets already matched per bucket and turns_remaining during the current turn
+        self._matched = {}
+        # Fleets sent by us this turn by (source, destination)
+        self._launched = {}
         self.planet_id_map = {}
         self.planet_id = 0
-        self._cache = {
+        # Incremented on every change of the game state. Cached query results are only valid for one version.
+        self.version = 0
+        self._queries = {}
+        self._query_version = 0
+        # N x N table of planet distances (indexed by planet id). Built once the map is known (@see distances).
+        self._distance_table = []
+        # For every planet the ids of all other planets ordered by distance (ties by id). Built with the distances.
+        self._neighbor_table = []
+        # Game state snapshot shared by all forks (@see fork)
+        self._fork_base = None
+        # Optional MapCache (@see mapcache.py) and the fingerprint of the current map (set once the map is known)
+        self.map_cache = None
+        self.map_fingerprint = None
+        self._static_data = {}
+        # Change events (@see events.py). Only created if somebody subscribed or record_changes is set.
+        self._subscribers = []
+        self.record_changes = False
+        self.changes = []
+        # TraceRing of this universe or None (@see trace.py)
+        self.trace = trace.ring
+        # Events queued during a state change (@see _hold_events)
+        self._held_events = None
+        # Arrival calendar: absolute arrival turn -> destination id -> owner id -> fleets.
+        # Arrival turns are counted from the start of the game (self.turn) so turn_done doesn't have to shift it.
+        self.turn = 0
+        self._calendar = {}
+        self._cache = self._new_cache()
+
+    def _new_cache(self):
+        return {
             "f": {
                 "o": SetDict(Fleets),
                 "s": SetDict(Fleets),
@@ -46,8 +105,16 @@ class Universe(object):
         Returns a set of fleets that matches *all* (i.e. boolean and) criteria.
         All parameters accept single or set arguments (e.g. player.ME vs. player.ENEMIES).
 
-        Returns <Fleets> (@see fleet.py) objects (a set subclass).
+        Returns read-only <Fleets> (@see fleet.py) objects (a set subclass). Results are cached until the
+        game state changes.
         """
+        key = ("f", _query_key(owner), _query_key(source), _query_key(destination))
+        result = self._cached_query(key)
+        if result is None:
+            result = self._cache_query(key, Fleets.read_only(self._find_fleets(owner, source, destination)))
+        return result
+
+    def _find_fleets(self, owner, source, destination):
         ret = []
         if owner:
             ret.append(self._cache["f"]["o"][Players(owner)])
@@ -66,8 +133,16 @@ class Universe(object):
         Returns a set of planets that matches *all* (i.e. boolean and) criteria.
         All parameters accept single or set arguments (e.g. player.ME vs. player.ENEMIES).
 
-        Returns <Planets> (@see planet.py) objects (a set subclass).
+        Returns read-only <Planets> (@see planet.py) objects (bitmask backed sets). Results are cached until the
+        game state changes.
         """
+        key = ("p", _query_key(owner), _query_key(growth_rate))
+        result = self._cached_query(key)
+        if result is None:
+            result = self._cache_query(key, Planets.read_only(self._find_planets(owner, growth_rate)))
+        return result
+
+    def _find_planets(self, owner, growth_rate):
         ret = []
         if owner:
             ret.append(self._cache["p"]["o"][Players(owner)])
@@ -80,6 +155,189 @@ class Universe(object):
             return Planets(ret[0])
         return Planets()
 
+    def _cached_query(self, key):
+        if self._query_version != self.version:
+            self._queries = {}
+            self._query_version = self.version
+        return self._queries.get(key)
+
+    def _cache_query(self, key, result):
+        if len(self._queries) >= QUERY_CACHE_SIZE:
+            self._queries = {}
+        self._queries[key] = result
+        return result
+
+    @property
+    def distances(self):
+        """N x N table of the distances (in turns) between all planets, indexed by planet id."""
+        self._ensure_tables()
+        return self._distance_table
+
+    @property
+    def neighbors(self):
+        """For every planet (by id) the ids of all other planets ordered by distance (ties by id)."""
+        self._ensure_tables()
+        return self._neighbor_table
+
+    def score_moves(self, candidates, turns=None, for_player=player.ME):
+        """
+        Scores a batch of candidate moves without sending anything. Every candidate is a list of
+        (source, destination, ship_count) orders (planets or planet ids).
+
+        All candidates are scored against one shared projection of the fleets in flight (@see timeline) over
+        <turns> turns (by default until the last fleet - in flight or sent by any candidate - arrives); only
+        the planets a candidate touches are re-simulated.
+        Returns a list of <MoveScore> (@see simulation.py) objects (from the point of view of <for_player>)
+        in the order of the candidates. Candidates that send more ships than a source has are scored as None.
+        """
+        planets = self._planets
+        candidates = [[(planets[getattr(source, "id", source)], planets[getattr(destination, "id", destination)],
+                        int(ship_count)) for source, destination, ship_count in orders] for orders in candidates]
+        if turns is None:
+            distances = self.distances
+            turns = max([fleet.turns_remaining for fleet in self.fleets] +
+                        [distances[source.id][destination.id]
+                         for orders in candidates for source, destination, _ in orders] or [0])
+        timeline = Timeline(self, turns)
+        base_losses = {}
+        return [score_orders(timeline, self.distances, orders, for_player.id, base_losses)
+                for orders in candidates]
+
+    def arriving_fleets(self, destination, turn, owner=None, last_turn=None):
+        """
+        Returns the <Fleets> arriving at <destination> (a planet or set of planets) in exactly <turn> turns
+        (or in <turn> to <last_turn> turns), optionally only those of <owner> (a Player or Players).
+        Looked up in the arrival calendar, i.e. O(result).
+        """
+        if last_turn is None:
+            last_turn = turn
+        if isinstance(destination, SET_TYPES):
+            destination_ids = [planet.id for planet in destination]
+        else:
+            destination_ids = [destination.id]
+        mask = owner is not None and Players(owner).mask
+        result = Fleets()
+        calendar = self._calendar
+        for arrival in xrange(self.turn + max(turn, 1), self.turn + last_turn + 1):
+            by_destination = calendar.get(arrival)
+            if not by_destination:
+                continue
+            for destination_id in destination_ids:
+                by_owner = by_destination.get(destination_id)
+                if not by_owner:
+                    continue
+                for owner_id, fleets in by_owner.iteritems():
+                    if mask is False or mask >> owner_id & 1:
+                        result.update(fleets)
+        return result
+
+    def arrival_forces(self, destination, turn):
+        """Returns a dict of Player -> number of ships arriving at planet <destination> in exactly <turn> turns."""
+        by_owner = self._calendar.get(self.turn + turn, {}).get(destination.id, {})
+        return dict([(player.PLAYER_MAP[owner_id], sum([fleet.ship_count for fleet in fleets]))
+                     for owner_id, fleets in by_owner.iteritems()])
+
+    def timeline(self, turns=None):
+        """
+        Projects the owner and ship count of every planet over the next <turns> turns
+        (by default until the last fleet currently in flight has arrived).
+
+        Returns a <Timeline> (@see simulation.py) object.
+        """
+        return Timeline(self, turns)
+
+    def static_data(self, name, compute):
+        """
+        Returns the map-static data <name> (e.g. a bot's turn 1 map analysis). It is computed by calling
+        compute(universe) once per map and kept in the map cache if there is one (@see mapcache.py), so later
+        games on the same map don't compute it at all.
+        The value has to be picklable and should refer to planets by id.
+        """
+        if name in self._static_data:
+            return self._static_data[name]
+        found, value = False, None
+        if self.map_cache is not None and self.map_fingerprint is not None:
+            found, value = self.map_cache.load_static(self.map_fingerprint, name)
+        if not found:
+            value = compute(self)
+            if self.map_cache is not None and self.map_fingerprint is not None:
+                try:
+                    self.map_cache.store_static(self.map_fingerprint, name, value)
+                except (IOError, OSError):
+                    log.warning("Couldn't write static data '%s' to the map cache" % (name, ), exc_info=True)
+        self._static_data[name] = value
+        return value
+
+    def subscribe(self, callback):
+        """Call <callback>(event) for every change event (@see events.py)."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def teardown(self):
+        """
+        Release all per-game state (planets, fleets, caches and indexes) and the references between the game
+        objects and this universe. The universe can't be used afterwards. Called by Game and the in-process
+        engine at the end of a game so that long running processes don't keep finished games alive.
+        """
+        for planet in self._planets.itervalues():
+            planet.universe = None
+        for bucket in self._fleets.itervalues():
+            for fleet in bucket:
+                fleet.universe = None
+        self.game = None
+        self._planets = {}
+        self._fleets = {}
+        self._matched = {}
+        self._launched = {}
+        self.planet_id_map = {}
+        self._queries = {}
+        self._distance_table = []
+        self._neighbor_table = []
+        self._fork_base = None
+        self.map_cache = None
+        self._static_data = {}
+        self._subscribers = []
+        self.changes = []
+        self._held_events = None
+        self.trace = None
+        self._calendar = {}
+        self._cache = self._new_cache()
+
+    def memory_usage(self):
+        """
+        Returns a dict with the approximate number of bytes held by this universe's "planets", "fleets",
+        "caches" (query results, the find_* indexes, static data, fork snapshot, change log) and "indexes"
+        (distance and neighbor tables, fleet buckets, arrival calendar) plus their "total".
+        Shared objects (e.g. Players) are not counted.
+        """
+        skip = (BasePlanet, BaseFleet, player.Player)
+        seen = set([id(self), id(self.game), id(None)])
+        def sizeof(*objects):
+            return sum([deep_sizeof(obj, seen, skip) for obj in objects])
+        usage = {}
+        usage["indexes"] = sizeof(self._distance_table, self._neighbor_table, self.planet_id_map, self._fleets, self._calendar,
+                                  self._matched, self._launched)
+        usage["planets"] = sum([deep_sizeof(planet, seen) + sizeof(getattr(planet, "__dict__", None))
+                                for planet in self._planets.itervalues()])
+        usage["fleets"] = sum([deep_sizeof(fleet, seen) + sizeof(getattr(fleet, "__dict__", None))
+                               for bucket in self._fleets.itervalues() for fleet in bucket])
+        usage["caches"] = sizeof(self._queries, self._cache, self._static_data, self.changes,
+                                 getattr(self._fork_base, "__dict__", None))
+        usage["total"] = sum(usage.values())
+        return usage
+
+    def fork(self):
+        """
+        Returns a sandboxed copy-on-write <UniverseFork> (@see fork.py) of the current game state.
+        Orders sent on the fork don't touch this universe. Forks are cheap (the snapshot they share is
+        created once per game state version).
+        """
+        if self._fork_base is None or self._fork_base.version != self.version:
+            self._fork_base = ForkBase(self)
+        return UniverseFork(self._fork_base)
+
 
     # Shortcut / Convenience properties
     @property
@@ -130,81 +388,378 @@ class Universe(object):
 
 
     def send_fleet(self, source, destination, ship_count):
-        log.debug("Sending fleet of %d from %s to %s." % (ship_count, source, destination))
-        if isinstance(destination, set):
+        # Formatted only if debug logging is on (the planet reprs are expensive)
+        log.debug("Sending fleet of %d from %s to %s.", ship_count, source, destination)
+        if isinstance(destination, SET_TYPES):
             new_fleets = Fleets()
             for target in destination:
-                source.ship_count -= ship_count
-                self.game.send_fleet(source.id, target.id, ship_count)
-                trip_length = source.distance(target)
-                new_fleets.add(self._add_fleet(player.ME.id, ship_count, source.id, target.id, trip_length, trip_length))
+                new_fleets.add(self._launch_fleet(source, target, ship_count))
             return new_fleets
         else:
-            source.ship_count -= ship_count
-            self.game.send_fleet(source.id, destination.id, ship_count)
-            trip_length = source.distance(destination)
-            return self._add_fleet(player.ME.id, ship_count, source.id, destination.id, trip_length, trip_length)
+            return self._launch_fleet(source, destination, ship_count)
+
+    def send_fleets(self, orders):
+        """
+        Send a batch of orders. <orders> is a sequence of (source, destination, ship_count) triples
+        (a list of tuples, a N x 3 array, ...). Sources and destinations may be Planets or planet ids.
+
+        All orders are validated in one pass before anything is sent: unknown planets, sources not owned by ME,
+        fleets sent to their own source, negative ship counts and sources that would send more ships than they
+        have raise InvalidOrders.
+        Returns the <Fleets> created by this action.
+        """
+        planets = self._planets
+        batch = []
+        invalid = []
+        committed = {}
+        for source, destination, ship_count in orders:
+            source_id = int(getattr(source, "id", source))
+            destination_id = int(getattr(destination, "id", destination))
+            ship_count = int(ship_count)
+            if source_id not in planets or destination_id not in planets or ship_count < 0 or \
+                    source_id == destination_id or planets[source_id].owner != player.ME:
+                invalid.append((source_id, destination_id, ship_count))
+                continue
+            committed[source_id] = committed.get(source_id, 0) + ship_count
+            batch.append((source_id, destination_id, ship_count))
+        if invalid:
+            raise InvalidOrders("Invalid planets, sources or ship counts in %d orders" % len(invalid), invalid)
+        overcommitted = [source_id for source_id, ship_count in committed.iteritems()
+                         if ship_count > planets[source_id].ship_count]
+        if overcommitted:
+            raise InvalidOrders("Planets %s don't have enough ships" % (overcommitted, ),
+                                [order for order in batch if order[0] in overcommitted])
+        self.game.send_fleets(batch)
+        new_fleets = Fleets()
+        for source_id, destination_id, ship_count in batch:
+            new_fleets.add(self._record_launch(planets[source_id], planets[destination_id], ship_count))
+        return new_fleets
+
+    def discard_orders(self):
+        """
+        Take back all fleets sent during the current turn (before Universe.turn_done): their ships return to
+        their source planets and the orders are removed from the game. Emits a FleetDiscarded per fleet.
+        """
+        if not self._launched:
+            return
+        self.version += 1
+        held = self._hold_events()
+        try:
+            for fleet in self._launched.itervalues():
+                source = fleet.source
+                source.ship_count += fleet.ship_count
+                self._remove_fleet(fleet)
+                if self._subscribers or self.record_changes:
+                    self._emit(ShipDelta(source, source.ship_count - fleet.ship_count, source.ship_count))
+                    self._emit(FleetDiscarded(fleet))
+            self._launched = {}
+            self.game.clear()
+        finally:
+            if held:
+                self._release_events()
 
     # Internal methods below. You should never need to call any of these yourself.
     #############
 
     def update(self, game_state_line):
-        """Update the game state. Gets called from Game."""
-        line = game_state_line.split("#")[0]
-        tokens = line.split()
-        if len(tokens) < 5:
-            # Garbage - ignore
-            return
-        if tokens[0] == "P":
-            if len(tokens) != 6:
-                raise ParsingException("Invalid format in gamestate: '%s'" % (game_state_line,))
-            id = _make_id(*tokens[1:3])
-            if id in self.planet_id_map:
-                self._update_planet(id, tokens[3:5])
-            else:
-                new_planet = self.planet_class(self, self.planet_id, *tokens[1:])
-                self._planets[self.planet_id] = new_planet
-                self.planet_id_map[id] = self.planet_id
-                self._cache['p']['o'][new_planet.owner].add(new_planet)
-                self._cache['p']['g'][new_planet.growth_rate].add(new_planet)
-                self.planet_id += 1
-        elif tokens[0] == "F":
-            if len(tokens) != 7:
-                raise ParsingException("Invalid format in gamestate: '%s'" % (game_state_line,))
-            self._add_fleet(*tokens[1:])
-
-    def _update_planet(self, planet_id, values):
-        planet = self._planets[self.planet_id_map[planet_id]]
+        """Update the game state from a single line. The distance and neighbor tables are (re)built on
+        their next use if this added a planet."""
+        self.version += 1
+        held = self._hold_events()
+        try:
+            line = game_state_line.split("#")[0]
+            tokens = line.split()
+            if len(tokens) < 5:
+                # Garbage - ignore
+                return
+            if tokens[0] == "P":
+                if len(tokens) != 6:
+                    raise ParsingException("Invalid format in gamestate: '%s'" % (game_state_line,))
+                planet_id = self.planet_id_map.get((tokens[1], tokens[2]))
+                if planet_id is None:
+                    self._add_planet(tokens[1:])
+                else:
+                    self._update_planet(self._planets[planet_id], tokens[3:5])
+            elif tokens[0] == "F":
+                if len(tokens) != 7:
+                    raise ParsingException("Invalid format in gamestate: '%s'" % (game_state_line,))
+                self._add_fleet(*tokens[1:])
+        finally:
+            if held:
+                self._release_events()
+
+    def update_state(self, game_state_lines):
+        """Update the game state from all lines the engine sent for one turn. Gets called from Game.
+
+        Planets are matched by their position. Once the map is known (i.e. after the first turn) the
+        distance table is built.
+
+        If a subclass overrides update() the lines are passed to it one by one instead of being parsed here.
+        """
+        planets = self._planets
+        planet_id_map = self.planet_id_map
+        new_planets = False
+        self.version += 1
+        held = self._hold_events()
+        try:
+            # Every state block lists all fleets
+            self._matched = {}
+            if type(self).update.im_func is not Universe.update.im_func:
+                planet_count = len(planets)
+                for game_state_line in game_state_lines:
+                    self.update(game_state_line)
+                if len(planets) != planet_count:
+                    self._build_distance_table()
+                return
+            for game_state_line in game_state_lines:
+                if "#" in game_state_line:
+                    tokens = game_state_line.split("#", 1)[0].split()
+                else:
+                    tokens = game_state_line.split()
+                if len(tokens) < 5:
+                    # Garbage - ignore
+                    continue
+                if tokens[0] == "P" and len(tokens) == 6:
+                    planet_id = planet_id_map.get((tokens[1], tokens[2]))
+                    if planet_id is None:
+                        self._add_planet(tokens[1:])
+                        new_planets = True
+                    else:
+                        self._update_planet(planets[planet_id], tokens[3:5])
+                elif tokens[0] == "F" and len(tokens) == 7:
+                    self._add_fleet(*tokens[1:])
+                elif tokens[0] in ("P", "F"):
+                    raise ParsingException("Invalid format in gamestate: '%s'" % (game_state_line,))
+            if new_planets:
+                self._build_distance_table()
+        finally:
+            if held:
+                self._release_events()
+
+    def set_state(self, planets, fleets):
+        """Update the game state from already parsed values (e.g. from an in-process engine).
+
+        <planets> is a sequence of (x, y, owner, ship_count, growth_rate) tuples,
+        <fleets> a sequence of (owner, ship_count, source, destination, trip_length, turns_remaining) tuples.
+        """
+        planet_id_map = self.planet_id_map
+        new_planets = False
+        self.version += 1
+        held = self._hold_events()
+        try:
+            self._matched = {}
+            for values in planets:
+                planet_id = planet_id_map.get((values[0], values[1]))
+                if planet_id is None:
+                    self._add_planet(values)
+                    new_planets = True
+                else:
+                    self._update_planet(self._planets[planet_id], values[2:4])
+            for values in fleets:
+                self._add_fleet(*values)
+            if new_planets:
+                self._build_distance_table()
+        finally:
+            if held:
+                self._release_events()
+
+    def _build_distance_table(self):
+        """Build the distance table and neighbor order for all planets. Since planets never move this only needs
+        to happen once (after the map has been parsed on the first turn). Uses the map cache if there is one."""
+        planets = [self._planets[id] for id in xrange(len(self._planets))]
+        self.map_fingerprint = map_fingerprint(planets)
+        self._static_data = {}
+        tables = None
+        if self.map_cache is not None:
+            tables = self.map_cache.load_tables(self.map_fingerprint, len(planets))
+        if tables is None:
+            tables = self._compute_tables(planets)
+            if self.map_cache is not None:
+                try:
+                    self.map_cache.store_tables(self.map_fingerprint, *tables)
+                except (IOError, OSError):
+                    log.warning("Couldn't write the map cache", exc_info=True)
+        self._distance_table, self._neighbor_table = tables
+        for planet, distances, neighbors in zip(planets, *tables):
+            planet._distances = distances
+            planet._neighbors = neighbors
+
+    def _ensure_tables(self):
+        """Build the distance and neighbor tables if planets were added since they were last built
+        (update_state and set_state build them right away, update() leaves that to the first use)."""
+        if len(self._distance_table) != len(self._planets):
+            self._build_distance_table()
+
+    def _compute_tables(self, planets):
+        """Returns the (distances, neighbors) tables of <planets>."""
+        rows = [[0] * len(planets) for _ in planets]
+        for i, planet in enumerate(planets):
+            row = rows[i]
+            for j in xrange(i + 1, len(planets)):
+                row[j] = rows[j][i] = point_distance(planet.position, planets[j].position)
+        distances = [array("i", row) for row in rows]
+        neighbors = []
+        for planet, row in zip(planets, distances):
+            order = sorted(xrange(len(planets)), key=lambda id: (row[id], id))
+            order.remove(planet.id)
+            neighbors.append(array("i", order))
+        return distances, neighbors
+
+    def _add_planet(self, values):
+        new_planet = self.planet_class(self, self.planet_id, *values)
+        self._planets[self.planet_id] = new_planet
+        self.planet_id_map[(values[0], values[1])] = self.planet_id
+        self._cache['p']['o'][new_planet.owner].add(new_planet)
+        self._cache['p']['g'][new_planet.growth_rate].add(new_planet)
+        self.planet_id += 1
+        return new_planet
+
+    def _update_planet(self, planet, values):
         old_owner = planet.owner
+        old_ship_count = planet.ship_count
         planet.update(*values)
         if planet.owner != old_owner:
             self._cache['p']['o'][old_owner].remove(planet)
             self._cache['p']['o'][planet.owner].add(planet)
+            if self._subscribers or self.record_changes:
+                self._emit(PlanetCaptured(planet, old_owner, planet.owner))
+        if planet.ship_count != old_ship_count and (self._subscribers or self.record_changes):
+            self._emit(ShipDelta(planet, old_ship_count, planet.ship_count))
 
-    def _add_fleet(self, *args):
-        id = _make_id(*args)
-        if id in self._fleets:
-            # (fleets already updated by turn_done)
-            return self._fleets[id]
-        else:
-            new_fleet = self.fleet_class(self, id, *args)
-            self._fleets[id] = new_fleet
-            self._cache['f']['o'][new_fleet.owner].add(new_fleet)
-            self._cache['f']['s'][new_fleet.source].add(new_fleet)
-            self._cache['f']['d'][new_fleet.destination].add(new_fleet)
-            return new_fleet
+    def _hold_events(self):
+        """Queue change events instead of emitting them while the state is half updated (subscribers could
+        otherwise cache query results of that state). Returns False if an outer call is holding them already."""
+        if self._held_events is not None:
+            return False
+        self._held_events = []
+        return True
 
-    def turn_done(self):
-        _fleets = {}
-        for id, fleet in self._fleets.items():
-            fleet.turns_remaining -= 1
-            # Ugh.. Since fleets have no id in the engine we have to make sure they match next turn
-            new_id = _make_id(fleet.owner.id, fleet.ship_count, fleet.source.id, fleet.destination.id, fleet.trip_length, fleet.turns_remaining)
-            if fleet.turns_remaining == 0:
-                self._cache['f']['o'][fleet.owner].remove(fleet)
-                self._cache['f']['s'][fleet.source].remove(fleet)
-                self._cache['f']['d'][fleet.destination].remove(fleet)
+    def _release_events(self):
+        """Emit the change events queued since _hold_events()."""
+        events, self._held_events = self._held_events, None
+        for event in events:
+            self._emit(event)
+
+    def _emit(self, event):
+        if self._held_events is not None:
+            self._held_events.append(event)
+            return
+        if self.record_changes:
+            self.changes.append(event)
+        for callback in self._subscribers:
+            callback(event)
+
+    def _launch_fleet(self, source, destination, ship_count):
+        self.game.send_fleet(source.id, destination.id, ship_count)
+        return self._record_launch(source, destination, ship_count)
+
+    def _record_launch(self, source, destination, ship_count):
+        """Update the local state for an order that has been passed on to the game."""
+        self.version += 1
+        if self.trace is not None:
+            self.trace.record("launch", source.id, destination.id, ship_count)
+        held = self._hold_events()
+        try:
+            source.ship_count -= ship_count
+            if self._subscribers or self.record_changes:
+                self._emit(ShipDelta(source, source.ship_count + ship_count, source.ship_count))
+            # The game aggregates all orders with the same source and destination into one fleet
+            fleet = self._launched.get((source.id, destination.id))
+            if fleet is None:
+                trip_length = self.distances[source.id][destination.id]
+                fleet = self._new_fleet(player.ME.id, ship_count, source.id, destination.id, trip_length, trip_length)
+                self._launched[(source.id, destination.id)] = fleet
             else:
-                _fleets[new_id] = fleet
-        self._fleets = _fleets
+                self._remove_from_bucket(fleet)
+                fleet.ship_count += ship_count
+                self._fleets.setdefault(self._fleet_key(fleet), []).append(fleet)
+                if self._subscribers or self.record_changes:
+                    self._emit(FleetLaunched(fleet, ship_count))
+            return fleet
+        finally:
+            if held:
+                self._release_events()
+
+    def _add_fleet(self, owner, ship_count, source, destination, trip_length, turns_remaining):
+        # Since fleets have no id in the engine we match them to the ones we already know by their attributes
+        # and the turns_remaining we expect them to have now (kept up to date by turn_done).
+        # Identical fleets are matched in the order we first saw them.
+        key = (int(owner), int(ship_count), int(source), int(destination), int(trip_length))
+        turns_remaining = int(turns_remaining)
+        match_key = key + (turns_remaining, )
+        skip = self._matched.get(match_key, 0)
+        self._matched[match_key] = skip + 1
+        for fleet in self._fleets.get(key, ()):
+            if fleet.turns_remaining == turns_remaining:
+                if not skip:
+                    return fleet
+                skip -= 1
+        return self._new_fleet(*(key + (turns_remaining, )))
+
+    def _new_fleet(self, owner, ship_count, source, destination, trip_length, turns_remaining):
+        new_fleet = self.fleet_class(self, self.fleet_id, owner, ship_count, source, destination, trip_length, turns_remaining)
+        self.fleet_id += 1
+        self._fleets.setdefault(self._fleet_key(new_fleet), []).append(new_fleet)
+        self._cache['f']['o'][new_fleet.owner].add(new_fleet)
+        self._cache['f']['s'][new_fleet.source].add(new_fleet)
+        self._cache['f']['d'][new_fleet.destination].add(new_fleet)
+        self._calendar.setdefault(self.turn + new_fleet.turns_remaining, {}).setdefault(
+            new_fleet.destination.id, {}).setdefault(new_fleet.owner.id, []).append(new_fleet)
+        if self._subscribers or self.record_changes:
+            self._emit(FleetLaunched(new_fleet, new_fleet.ship_count))
+        return new_fleet
+
+    def _fleet_key(self, fleet):
+        return (fleet.owner.id, fleet.ship_count, fleet.source.id, fleet.destination.id, fleet.trip_length)
 
+    def _remove_from_bucket(self, fleet):
+        key = self._fleet_key(fleet)
+        bucket = self._fleets[key]
+        bucket.remove(fleet)
+        if not bucket:
+            del self._fleets[key]
+
+    def _remove_from_calendar(self, fleet):
+        arrival = self.turn + fleet.turns_remaining
+        by_destination = self._calendar[arrival]
+        by_owner = by_destination[fleet.destination.id]
+        fleets = by_owner[fleet.owner.id]
+        fleets.remove(fleet)
+        if not fleets:
+            del by_owner[fleet.owner.id]
+            if not by_owner:
+                del by_destination[fleet.destination.id]
+                if not by_destination:
+                    del self._calendar[arrival]
+
+    def _remove_fleet(self, fleet):
+        self._remove_from_bucket(fleet)
+        self._remove_from_calendar(fleet)
+        self._cache['f']['o'][fleet.owner].remove(fleet)
+        self._cache['f']['s'][fleet.source].remove(fleet)
+        self._cache['f']['d'][fleet.destination].remove(fleet)
+
+    def turn_done(self):
+        self.version += 1
+        self._matched = {}
+        self._launched = {}
+        self.changes = []
+        for bucket in self._fleets.itervalues():
+            for fleet in bucket:
+                fleet.turns_remaining -= 1
+        self.turn += 1
+        # Everything in the calendar bucket of the new turn has arrived
+        arrived = []
+        for by_owner in self._calendar.get(self.turn, {}).itervalues():
+            for fleets in by_owner.itervalues():
+                arrived.extend(fleets)
+        held = self._hold_events()
+        try:
+            observed = self._subscribers or self.record_changes
+            for fleet in arrived:
+                if observed:
+                    self._emit(FleetArrived(fleet))
+                self._remove_fleet(fleet)
+        finally:
+            if held:
+                self._release_events()
@@ -1,4 +1,4 @@
-from hashlib import sha256
+import sys
 from logging import getLogger, Handler
 from planetwars.compat import namedtuple
 from functools import update_wrapper
@@ -16,8 +16,12 @@ class ParsingException(Exception):
 class TimeIsUp(Exception):
     pass
 
-def _make_id(*args):
-    return filter(lambda y: y.isdigit(), sha256("".join(map(str, args))).hexdigest()[:16])
+class InvalidOrders(Exception):
+    """Raised by Universe.send_fleets if a batch of orders is invalid (nothing is sent then).
+    <orders> is the list of the offending orders."""
+    def __init__(self, message, orders=()):
+        super(InvalidOrders, self).__init__(message)
+        self.orders = list(orders)
 
 #noinspection PyUnusedLocal
 def timeout_handler(signal, frame):
@@ -35,18 +39,21 @@ class TypedSetMeta(type):
 
     def __new__(cls, name, bases, attrs):
         new_cls = super(TypedSetMeta, cls).__new__(cls, name, bases, attrs)
+        accepts = getattr(new_cls, 'accepts', ())
+        # Class of the sets returned by the wrapped methods (read-only sets return modifiable ones)
+        result_cls = attrs.get('mutable_class', new_cls)
         def wrapper(method_name):
-            def inner(self, other):
-                if isinstance(other, attrs.get('accepts', ())):
-                    other = new_cls([other])
-                return new_cls(getattr(super(new_cls, self), method_name)(other))
+            def inner(self, *others):
+                others = [isinstance(other, accepts) and result_cls([other]) or other for other in others]
+                return result_cls(getattr(super(new_cls, self), method_name)(*others))
             return update_wrapper(inner, getattr(new_cls, method_name), assigned=("__name__", "__doc__"), updated=())
         for method_name in cls.methods:
-            setattr(new_cls, method_name, wrapper(method_name))
+            if method_name not in attrs:
+                setattr(new_cls, method_name, wrapper(method_name))
 
         old_init = getattr(new_cls, "__init__")
         def new_init(self, iterable_or_item=()):
-            if isinstance(iterable_or_item, attrs.get('accepts', ())):
+            if isinstance(iterable_or_item, accepts):
                 old_init(self, [iterable_or_item])
                 return
             old_init(self, iterable_or_item)
@@ -57,6 +64,324 @@ class TypedSetMeta(type):
 class TypedSetBase(set):
     __metaclass__ = TypedSetMeta
 
+    @classmethod
+    def read_only(cls, iterable_or_item=()):
+        """Returns a read-only set of this type. Methods that would modify it raise TypeError,
+        in-place operators (|=, &=, -=, ^=) return a new (modifiable) set instead and copy() returns a modifiable copy.
+        """
+        return _read_only_class(cls)(iterable_or_item)
+
+def _read_only_class(cls):
+    read_only_cls = cls.__dict__.get('_read_only_class')
+    if read_only_cls is None:
+        attrs = _read_only_attrs(cls)
+        if '__slots__' in cls.__dict__:
+            attrs['__slots__'] = ()
+        read_only_cls = type(cls)("ReadOnly%s" % cls.__name__, (cls, ), attrs)
+        cls._read_only_class = read_only_cls
+        # Bind it in the module of <cls> so pickle can find it
+        module = sys.modules.get(cls.__module__)
+        if module is not None and not hasattr(module, read_only_cls.__name__):
+            setattr(module, read_only_cls.__name__, read_only_cls)
+    return read_only_cls
+
+def _read_only_attrs(mutable_cls):
+    def modify(self, *args):
+        raise TypeError("%s is read-only. Use copy() to get a modifiable set." % (type(self).__name__, ))
+    def operator(method_name):
+        def inner(self, other):
+            return getattr(self, method_name)(other)
+        return inner
+    attrs = {
+        'mutable_class': mutable_cls,
+        'copy': lambda self: mutable_cls(self),
+        '__ior__': operator('__or__'),
+        '__iand__': operator('__and__'),
+        '__isub__': operator('__sub__'),
+        '__ixor__': operator('__xor__'),
+        '__module__': mutable_cls.__module__,
+    }
+    for method_name in ('add', 'remove', 'discard', 'pop', 'clear', 'update', 'difference_update',
+                        'intersection_update', 'symmetric_difference_update'):
+        attrs[method_name] = modify
+    return attrs
+
+
+def _bits(mask):
+    """Yields the indices of all set bits of <mask> in ascending order."""
+    index = 0
+    while mask:
+        if not mask & 0xff:
+            mask >>= 8
+            index += 8
+            continue
+        if mask & 1:
+            yield index
+        mask >>= 1
+        index += 1
+
+# Number of set bits of every byte value (bin() needs Python 2.6)
+_BYTE_BITS = [0] * 256
+for _byte in xrange(1, 256):
+    _BYTE_BITS[_byte] = _BYTE_BITS[_byte >> 1] + (_byte & 1)
+del _byte
+
+def _bit_count(mask):
+    count = 0
+    while mask:
+        count += _BYTE_BITS[mask & 0xff]
+        mask >>= 8
+    return count
+
+class BitSetBase(object):
+    """Set of objects that have small, dense integer ids (e.g. players or planets) stored as an integer bitmask.
+    Membership tests, unions, intersections and differences are single integer operations.
+
+    It supports the same operations as the builtin set (and TypedSetBase). Like with TypedSetBase
+    single objects of the accepted types can be used as operands directly.
+
+    Subclasses have to define accepts and _lookup_for() which returns a mapping of ids to objects.
+    """
+    __slots__ = ('mask', '_lookup')
+    accepts = ()
+    # Class of the sets returned by operators (read-only sets return modifiable ones)
+    mutable_class = None
+    __hash__ = None
+
+    def __init__(self, iterable_or_item=()):
+        self.mask, self._lookup = self._mask(iterable_or_item)
+
+    @classmethod
+    def _lookup_for(cls, element):
+        raise NotImplementedError()
+
+    def _mask(self, other):
+        """Returns the mask and id lookup of <other> (a BitSetBase, a single object or an iterable of objects)."""
+        if isinstance(other, BitSetBase):
+            if other.accepts != self.accepts:
+                raise TypeError("%s can't be combined with %s" % (type(self).__name__, type(other).__name__))
+            return other.mask, other._lookup
+        if isinstance(other, self.accepts):
+            return 1 << other.id, self._lookup_for(other)
+        mask = 0
+        lookup = None
+        for element in other:
+            if not isinstance(element, self.accepts):
+                raise TypeError("%s can only contain %s objects, not %s" % (
+                    type(self).__name__, "/".join([cls.__name__ for cls in self.accepts]), type(element).__name__))
+            mask |= 1 << element.id
+            if lookup is None:
+                lookup = self._lookup_for(element)
+        return mask, lookup
+
+    def _new(self, mask, lookup=None):
+        result = object.__new__(self.mutable_class or type(self))
+        result.mask = mask
+        result._lookup = self._lookup
+        if result._lookup is None:
+            result._lookup = lookup
+        return result
+
+    def __iter__(self):
+        lookup = self._lookup
+        for id in _bits(self.mask):
+            yield lookup[id]
+
+    def __len__(self):
+        return _bit_count(self.mask)
+
+    # __slots__ classes need these for pickle protocols < 2
+    def __getstate__(self):
+        return self.mask, self._lookup
+
+    def __setstate__(self, state):
+        self.mask, self._lookup = state
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    def __contains__(self, item):
+        if not isinstance(item, self.accepts):
+            return False
+        return bool(self.mask >> item.id & 1)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, list(self))
+
+    def __or__(self, other):
+        mask, lookup = self._mask(other)
+        return self._new(self.mask | mask, lookup)
+    __ror__ = __or__
+
+    def __and__(self, other):
+        mask, lookup = self._mask(other)
+        return self._new(self.mask & mask, lookup)
+    __rand__ = __and__
+
+    def __sub__(self, other):
+        mask, lookup = self._mask(other)
+        return self._new(self.mask & ~mask, lookup)
+
+    def __rsub__(self, other):
+        mask, lookup = self._mask(other)
+        return self._new(mask & ~self.mask, lookup)
+
+    def __xor__(self, other):
+        mask, lookup = self._mask(other)
+        return self._new(self.mask ^ mask, lookup)
+    __rxor__ = __xor__
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, BitSetBase):
+            return self.mask == other.mask
+        if isinstance(other, (set, frozenset)):
+            return set(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def issubset(self, other):
+        mask, _ = self._mask(other)
+        return self.mask & ~mask == 0
+    __le__ = issubset
+
+    def issuperset(self, other):
+        mask, _ = self._mask(other)
+        return mask & ~self.mask == 0
+    __ge__ = issuperset
+
+    def __lt__(self, other):
+        return self.mask != self._mask(other)[0] and self.issubset(other)
+
+    def __gt__(self, other):
+        return self.mask != self._mask(other)[0] and self.issuperset(other)
+
+    def isdisjoint(self, other):
+        return self.mask & self._mask(other)[0] == 0
+
+    def union(self, *others):
+        result = self.copy()
+        result.update(*others)
+        return result
+
+    def intersection(self, *others):
+        result = self.copy()
+        result.intersection_update(*others)
+        return result
+
+    def difference(self, *others):
+        result = self.copy()
+        result.difference_update(*others)
+        return result
+
+    def symmetric_difference(self, other):
+        return self ^ other
+
+    def copy(self):
+        return self._new(self.mask)
+    __copy__ = copy
+
+    def add(self, item):
+        self.mask |= 1 << item.id
+        if self._lookup is None:
+            self._lookup = self._lookup_for(item)
+
+    def remove(self, item):
+        if item not in self:
+            raise KeyError(item)
+        self.mask &= ~(1 << item.id)
+
+    def discard(self, item):
+        if item in self:
+            self.mask &= ~(1 << item.id)
+
+    def pop(self):
+        if not self.mask:
+            raise KeyError("pop from an empty set")
+        index = _bits(self.mask).next()
+        self.mask &= ~(1 << index)
+        return self._lookup[index]
+
+    def clear(self):
+        self.mask = 0
+
+    def update(self, *others):
+        for other in others:
+            mask, lookup = self._mask(other)
+            self.mask |= mask
+            if self._lookup is None:
+                self._lookup = lookup
+
+    def intersection_update(self, *others):
+        for other in others:
+            self.mask &= self._mask(other)[0]
+
+    def difference_update(self, *others):
+        for other in others:
+            self.mask &= ~self._mask(other)[0]
+
+    def symmetric_difference_update(self, other):
+        mask, lookup = self._mask(other)
+        self.mask ^= mask
+        if self._lookup is None:
+            self._lookup = lookup
+
+    @classmethod
+    def read_only(cls, iterable_or_item=()):
+        """Returns a read-only set of this type (@see TypedSetBase.read_only)."""
+        return _read_only_class(cls)(iterable_or_item)
+
+# Types that are treated as sets of game objects (e.g. in SetDict keys or as send_fleet targets)
+SET_TYPES = (set, frozenset, BitSetBase)
+
+
+def deep_sizeof(obj, seen=None, skip=()):
+    """Returns the approximate number of bytes held by <obj> and all containers (dicts, lists, tuples, sets,
+    arrays) it references. Objects of the types in <skip> and objects whose id is in <seen> are not counted
+    (<seen> is updated, pass the same set to several calls to avoid counting shared objects twice).
+    Returns 0 on Python versions without sys.getsizeof.
+    """
+    getsizeof = getattr(sys, "getsizeof", None)
+    if getsizeof is None:
+        return 0
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, skip):
+            continue
+        seen.add(id(obj))
+        size += getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, BitSetBase):
+            stack.append(obj.mask)
+    return size
 
 class SetDict(defaultdict):
     """A set-oriented defaultdict subclass that allows sets
@@ -79,24 +404,24 @@ class SetDict(defaultdict):
     set(['a', 'c', 'b', 'd']
     """
     def __init__(self, defaultfactory=set):
-        if not issubclass(defaultfactory, set):
+        if not issubclass(defaultfactory, SET_TYPES):
             raise TypeError("SetDict can only use set based defaultfactories.")
         super(SetDict, self).__init__(defaultfactory)
 
     def __getitem__(self, key):
-        if isinstance(key, set):
-            return reduce(lambda x,y: x | y, (super(SetDict, self).__getitem__(k) for k in key), set())
+        if isinstance(key, SET_TYPES):
+            return reduce(lambda x,y: x | y, (super(SetDict, self).__getitem__(k) for k in key), self.default_factory())
         return super(SetDict, self).__getitem__(key)
 
     def __setitem__(self, key, value):
-        if isinstance(key, set):
+        if isinstance(key, SET_TYPES):
             for k in key:
                 super(SetDict, self).__setitem__(k, value)
             return
         super(SetDict, self).__setitem__(key, value)
 
     def __delitem__(self, key, value):
-        if isinstance(key, set):
+        if isinstance(key, SET_TYPES):
             for k in key:
                 super(SetDict, self).__delitem__(k)
             return